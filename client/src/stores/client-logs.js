@@ -4,7 +4,10 @@ import { v4 as uuid } from "uuid"
 
 import { client_log_entry_types } from "../../../server/constants.json"
 import { debounceFunc, isDev } from "../utils"
-import { conn, messageServer } from "./connection"
+import { conn, messageServer, serverSupports } from "./connection"
+
+const LOG_BATCH_SIZE = 250
+const LOG_REFERENCE_FIELDS = ["asset_id", "rotator_id", "stopset_id"]
 
 let pendingLogs = new Map()
 try {
@@ -16,24 +19,41 @@ try {
 const savePendingLogs = () =>
   window.localStorage.setItem("pending-logs", JSON.stringify(Array.from(pendingLogs.entries()), null, ""))
 
-export const log = (type = "unspecified", description = "") => {
+// refs are structured asset_id, rotator_id and stopset_id references for play events
+export const log = (type = "unspecified", description = "", refs = {}) => {
   if (!client_log_entry_types.includes(type)) {
     console.error(`Invalid log type: ${type} - using unspecified`)
     type = "unspecified"
   }
 
-  pendingLogs.set(uuid(), { created_at: dayjs().toISOString(), type, description })
+  pendingLogs.set(uuid(), { created_at: dayjs().toISOString(), type, description, ...refs })
   savePendingLogs()
 }
 
+// Older servers reject log entries with fields they don't know about
+const stripUnsupportedFields = (data) => {
+  if (serverSupports("log-refs")) {
+    return data
+  }
+  return Object.fromEntries(Object.entries(data).filter(([key]) => !LOG_REFERENCE_FIELDS.includes(key)))
+}
+
 export const sendPendingLogs = (forceClear = false) => {
-  const entries = Array.from(pendingLogs.entries())
+  const entries = Array.from(pendingLogs.entries()).map(([id, data]) => [id, stripUnsupportedFields(data)])
   if (entries.length) {
     const { authenticated, connected } = get(conn)
     if (authenticated && connected) {
-      for (const [id, data] of entries) {
-        messageServer("log", { id, ...data })
-        console.log("Sending log:", { id, ...data })
+      if (serverSupports("log-batch")) {
+        for (let i = 0; i < entries.length; i += LOG_BATCH_SIZE) {
+          const logs = entries.slice(i, i + LOG_BATCH_SIZE).map(([id, data]) => ({ id, ...data }))
+          messageServer("log-batch", { logs })
+          console.log(`Sending batch of ${logs.length} logs`)
+        }
+      } else {
+        for (const [id, data] of entries) {
+          messageServer("log", { id, ...data })
+          console.log("Sending log:", { id, ...data })
+        }
       }
     }
   }
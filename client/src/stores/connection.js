@@ -23,7 +23,20 @@ const connEphemeral = writable({
 })
 const reloading = writable(false) // Whether the whole app is in the reloading process
 let loggingOut = false
+let serverFeatures = []
 export const protocolVersion = protocol_version
+export const serverSupports = (feature) => serverFeatures.includes(feature)
+
+const getServerFeatures = async (wsHost) => {
+  // The server's status (at the same URL as its websocket) lists optional features, before we've authenticated
+  try {
+    const response = await fetch(wsHost.replace(/^ws/i, "http"), { signal: AbortSignal.timeout(5000) })
+    return (await response.json()).features || []
+  } catch (e) {
+    console.warn("Couldn't get server features, assuming none", e)
+    return []
+  }
+}
 
 const online = writable(navigator.onLine)
 window.addEventListener("offline", () => online.set(false))
@@ -68,6 +81,26 @@ const updateConn = ({ connecting, connected, ...restPersisted }) => {
 let ws = (window._websocket = null)
 let heartbeatInterval = null
 let lastHeartbeat = 0
+// Last full data received from server and its revision, used to apply data patches
+let lastServerData = null
+let lastDataRevision = null
+
+const applyDataPatch = (data, patch) => {
+  const patched = { ...data }
+  for (const entityType of ["assets", "rotators", "stopsets"]) {
+    const { added, changed, removed } = patch[entityType]
+    const entities = new Map(data[entityType].map((entity) => [entity.id, entity]))
+    removed.forEach((id) => entities.delete(id))
+    for (const entity of [...added, ...changed]) {
+      entities.set(entity.id, entity)
+    }
+    patched[entityType] = Array.from(entities.values()).sort((a, b) => a.id - b.id)
+  }
+  if (patch.config) {
+    patched.config = patch.config
+  }
+  return patched
+}
 
 export const logout = (error = null, hardLogout = false) => {
   if (loggingOut) return
@@ -100,7 +133,11 @@ export const logout = (error = null, hardLogout = false) => {
 
 // Functions defined for various message types we get from server after authentication
 const handleMessages = {
-  data: async ({ config, ...data }) => {
+  data: async ({ revision, ...data }) => {
+    lastServerData = data
+    lastDataRevision = revision || null
+    const { config, ...assetsData } = data
+    data = assetsData
     setServerConfig(config)
     const isFirstSync = !get(conn).didFirstSync
     await syncAssetsDB(data, isFirstSync)
@@ -109,6 +146,15 @@ const handleMessages = {
       updateConn({ didFirstSync: true })
     }
   },
+  "data-patch": async ({ revision, base_revision, ...patch }) => {
+    if (!lastServerData || base_revision !== lastDataRevision) {
+      console.warn(`Got data patch for revision ${base_revision}, but have ${lastDataRevision}. Reconnecting.`)
+      lastDataRevision = null
+      ws.reconnect()
+      return
+    }
+    await handleMessages.data({ revision, ...applyDataPatch(lastServerData, patch) })
+  },
   "ack-log": ({ success, id }) => {
     if (success) {
       console.log(`Acknowledged log ${id}`)
@@ -222,11 +268,26 @@ export const login = (username, password, host) => {
       }
     }
 
-    ws.onmessage = async (e) => {
-      const message = JSON.parse(e.data)
+    ws.binaryType = "arraybuffer"
+    // Messages are dispatched one at a time in arrival order, so a text frame never overtakes a gzipped one still being
+    // decompressed (ie a data patch being applied before the snapshot it's based on). Handlers aren't waited on, since
+    // a data sync can take minutes and pings can't wait that long, but they take what they need from messages up front.
+    let messageQueue = Promise.resolve()
+    const enqueue = (func) => {
+      messageQueue = messageQueue.then(func).catch((e) => console.error("Error handling websocket message", e))
+    }
+
+    const handleMessage = async (data) => {
+      if (data instanceof ArrayBuffer) {
+        // Large messages (ie data snapshots) are pre-compressed by the server
+        const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream("gzip"))
+        data = await new Response(stream).text()
+      }
+      const message = JSON.parse(data)
       if (!gotAuthResponse) {
         gotAuthResponse = true
         if (message.success) {
+          serverFeatures = message.features || []
           updateConn({ authenticated: true, connecting: false, connected: true, username, password, host })
           clearTimeout(connTimeout)
           log("login")
@@ -239,17 +300,29 @@ export const login = (username, password, host) => {
       } else if (get(conn).authenticated) {
         const func = handleMessages[message.type]
         if (func) {
-          await func(message.data)
+          Promise.resolve(func(message.data)).catch((e) => console.error(`Error handling ${message.type} message`, e))
         } else {
           console.log(`Unrecognized message type: ${message.type}`)
         }
       }
     }
-    ws.onopen = () => {
-      gotAuthResponse = false
+    ws.onmessage = (e) => enqueue(() => handleMessage(e.data))
+    ws.onopen = async () => {
+      enqueue(() => (gotAuthResponse = false)) // After any messages from the previous connection
       updateConn({ connected: false, connecting: true })
-      ws.send(JSON.stringify({ username, password, protocol_version, tomato: "radio-automation" }))
       connTimeout = setTimeout(() => ws.close(), 15000)
+      // Older servers reject greetings with keys they don't know, so only opt in to what this one supports
+      const features = await getServerFeatures(host)
+      ws.send(
+        JSON.stringify({
+          username,
+          password,
+          protocol_version,
+          tomato: "radio-automation",
+          ...(features.includes("data-patches") && { data_patches: true, data_revision: lastDataRevision }),
+          ...(features.includes("gzip") && { compression: "gzip" })
+        })
+      )
     }
 
     clearInterval(heartbeatInterval)
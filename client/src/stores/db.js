@@ -108,6 +108,8 @@ const processFileData = (file, url, filesize, md5sum, db, duration = undefined)
     url: `${db.host}${url}`,
     localUrl: pathToFileURL(filePath),
     path: filePath,
+    // Where this file was kept before the server sharded its media directory
+    unshardedPath: path.join(assetsDir, basename),
     basename,
     size: filesize,
     md5sum: md5sum,
@@ -134,7 +136,7 @@ class Asset extends AssetStopsetHydratableObject {
 
     for (let i = 0; i < files.length; i++) {
       const file = files[i]
-      const { url, path, size, md5sum, dirname, tmpPath, tmpBasename } = file
+      const { url, path, unshardedPath, size, md5sum, dirname, tmpPath, tmpBasename } = file
 
       try {
         let exists = await fileExists(path)
@@ -147,6 +149,14 @@ class Asset extends AssetStopsetHydratableObject {
             exists = false
           }
         }
+        if (!exists && unshardedPath !== path && (await fileExists(unshardedPath))) {
+          // Sharding keeps the same filename, so move over our existing copy rather than downloading it again
+          if ((await fileSize(unshardedPath)) === size) {
+            await fs.mkdir(dirname, { recursive: true })
+            await fs.rename(unshardedPath, path)
+            exists = true
+          }
+        }
         if (!exists) {
           console.log(`Downloading: ${url} (asset: ${this.name}${i > 0 ? `, alt #${i}` : ""})`)
           await download(url, dirname, {
@@ -426,7 +436,7 @@ class DB {
       // For all non-garbage collected assets (+alternates ), get set of used files
       const usedFiles = new Set(
         Array.from(this._nonGarbageCollectedAssets.values())
-          .map((a) => [a.file.basename, ...a.alternates.map((a) => a.basename)])
+          .map((a) => [a.file.path, ...a.alternates.map((a) => a.path)])
           .flat(1)
       )
 
@@ -436,7 +446,7 @@ class DB {
       // Go through all files in assetsDir and make sure they'e used
       const foundFiles = await lsDir(assetsDir)
       for (const filePath of foundFiles) {
-        if (!usedFiles.has(path.basename(filePath))) {
+        if (!usedFiles.has(filePath)) {
           // Wait until _next_ cleanup to delete the files (just to be on the safe side)
           if (this._filesToCleanup.has(filePath)) {
             await fs.unlink(filePath)
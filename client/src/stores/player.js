@@ -162,6 +162,10 @@ class GeneratedStopsetAssetBase {
     return line
   }
 
+  get logRefs() {
+    return { asset_id: this.id, rotator_id: this.rotator.id, stopset_id: this.generatedStopset.id }
+  }
+
   done() {
     this.playing = false
     this.generatedStopset.donePlaying()
@@ -332,7 +336,7 @@ class PlayableAsset extends GeneratedStopsetAssetBase {
 
   done() {
     clearInterval(this.interval)
-    log(this.didSkip ? "skipped_asset" : "played_asset", this.logLine)
+    log(this.didSkip ? "skipped_asset" : "played_asset", this.logLine, this.logRefs)
     super.done()
   }
 
@@ -549,7 +553,9 @@ export class GeneratedStopset {
     }
     if (!skipLog && !this.didLog) {
       this.didLog = true
-      log(this.didSkip || forceDidSkip ? "skipped_stopset" : "played_stopset", `[Stopset=${this.name}]`)
+      log(this.didSkip || forceDidSkip ? "skipped_stopset" : "played_stopset", `[Stopset=${this.name}]`, {
+        stopset_id: this.id
+      })
     }
   }
 
@@ -559,7 +565,7 @@ export class GeneratedStopset {
       if (subindex !== null && subindex !== this.current) {
         // Pause items up to subindex
         this.items.slice(this.current, subindex).forEach((item) => {
-          log("skipped_asset", item.logLine)
+          log("skipped_asset", item.logLine, item.logRefs)
           if (item.playable) {
             // Avoids LED and button flash since the pause as the pause() called on the asset
             // here is to pause the underlying MediaElement, not pause the whole stopset
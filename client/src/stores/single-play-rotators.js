@@ -50,7 +50,10 @@ export const stop = () => {
 export const play = (asset, rotator) => {
   clearInterval(interval) // Just in case we enter twice
 
-  log("played_single", `[Rotator=${rotator.name}] [Asset=${asset.name}]`)
+  log("played_single", `[Rotator=${rotator.name}] [Asset=${asset.name}]`, {
+    asset_id: asset.id,
+    rotator_id: rotator.id
+  })
   const files = [
     [asset.duration, asset.file.localUrl],
     ...asset.alternates.map(({ duration, localUrl }) => [duration, localUrl])
@@ -7,7 +7,7 @@ uvicorn.run(
     "api:app",
     host="0.0.0.0",
     port=8000,
-    workers=1,
+    workers=settings.API_WORKERS,
     forwarded_allow_ips="*",
     proxy_headers=True,
     reload=settings.DEBUG,
@@ -20,7 +20,10 @@ from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 django.setup()
 
 from .base import SERVER_STATUS
-from .connections import admins, users, send_connection_heartbeats
+from .client_logs import client_log_writer
+from .connections import admins, maintain_connection_directory, send_connection_heartbeats, users
+from .db import db_pool
+from .directory import forget_process, keep_process_alive
 from .schemas import greeting_schema
 from .server_messages import server_messages
 from .utils import RUNNING_TASKS, TomatoAuthError, init_logger
@@ -71,12 +74,19 @@ async def status(request: Request):
 async def startup():
     init_logger()
 
+    await keep_process_alive()
+    for connections in (users, admins):
+        await connections.directory.prune(at_startup=True)  # Before accepting any connections
     await users.init_last_serialized_data()
+    maintain_connection_directory()
     server_messages.consume_redis_notifications()
     send_connection_heartbeats()
 
 
 async def shutdown():
+    await forget_process()
+    await client_log_writer.close()
+    await db_pool.close()
     for running_task in RUNNING_TASKS:
         running_task.cancel()
         await running_task
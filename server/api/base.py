@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict
 from importlib import import_module
 from inspect import iscoroutinefunction
@@ -16,24 +17,50 @@ from tomato.constants import PROTOCOL_VERSION
 from tomato.models import User
 from tomato.utils import django_json_dumps
 
-from .utils import TomatoAuthError, get_config_async
+from .db import get_config, get_user
+from .directory import ConnectionDirectory
+from .schemas import ServerMessageTypes
+from .utils import PROCESS_ID, TomatoAuthError, publish_server_messages
 
 
 logger = logging.getLogger(__name__)
-SERVER_STATUS = {"server": "Tomato Radio Automation", "version": settings.TOMATO_VERSION, "protocol": PROTOCOL_VERSION}
+SERVER_STATUS = {
+    "server": "Tomato Radio Automation",
+    "version": settings.TOMATO_VERSION,
+    "protocol": PROTOCOL_VERSION,
+    # Optional greeting keys and messages clients can use with this server, also served by the status endpoint
+    "features": ["data-patches", "gzip", "log-batch", "log-refs"],
+}
 SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+OUTBOUND_QUEUE_MAX_SIZE = 100  # Connections with more messages than this waiting to be sent get evicted
+SEND_TIMEOUT = 30  # Seconds
+CLOSE_TIMEOUT = 5
 
 
 class Connection:
-    def __init__(self, websocket: WebSocket, user: User):
+    def __init__(self, websocket: WebSocket, user: User, greeting: dict):
         self._ws: WebSocket = websocket
         self.id = str(uuid.uuid4())
         self.user: User = user
+        # Clients that opt in receive data patches against the catalog revision they last saw
+        self.supports_data_patches: bool = greeting.get("data_patches", False)
+        self.data_revision: str | None = greeting.get("data_revision")
+        self.compression: str | None = greeting.get("compression")
+        # Outgoing messages are queued and sent by a dedicated writer task, so one slow client can't hold up others
+        self._queue: asyncio.Queue[str | bytes | None] = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+        self._close_task: asyncio.Task | None = None
+        self.evicted = False
+        self.stats = {"sent": 0, "max_queued": 0, "send_timeouts": 0}
 
     @property
     def addr(self):
         return self._ws.client.host
 
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
     async def receive(self):
         return await self._ws.receive_json()
 
@@ -47,11 +74,72 @@ class Connection:
     async def send(self, obj):
         await self.send_raw(django_json_dumps(obj))
 
-    async def send_raw(self, text):
-        await self._ws.send_text(text)
+    async def send_raw(self, text_or_bytes):
+        if self.evicted:
+            return
+        self._queue.put_nowait(text_or_bytes)
+        self.stats["max_queued"] = max(self.stats["max_queued"], self.queued)
+        if self.queued > OUTBOUND_QUEUE_MAX_SIZE:
+            logger.warning(f"Outbound queue for {self} exceeded {OUTBOUND_QUEUE_MAX_SIZE} messages. Evicting.")
+            self.evict()
+
+    def start_writer(self):
+        self._writer_task = asyncio.create_task(self._run_writer())
+
+    async def stop_writer(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+
+    async def _run_writer(self):
+        while True:
+            text_or_bytes = await self._queue.get()
+            if text_or_bytes is None:  # Sentinel queued by disconnect()
+                await self._close()
+                return
+            try:
+                if isinstance(text_or_bytes, bytes):
+                    send = self._ws.send_bytes(text_or_bytes)  # Pre-compressed message
+                else:
+                    send = self._ws.send_text(text_or_bytes)
+                await asyncio.wait_for(send, SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stats["send_timeouts"] += 1
+                logger.warning(f"Sending to {self} timed out after {SEND_TIMEOUT}s. Evicting.")
+                self.evict()
+                return
+            except Exception:
+                logger.exception("Recoverable error while sending to websocket")
+            else:
+                self.stats["sent"] += 1
+
+    async def _close(self):
+        try:
+            await asyncio.wait_for(self._ws.close(), CLOSE_TIMEOUT)
+        except Exception:
+            logger.exception(f"Error closing websocket for {self}")
+
+    def evict(self):
+        # Returns immediately, closing in the background, so a dead client doesn't hold up whoever is broadcasting
+        if self.evicted:
+            return
+        self.evicted = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._writer_task is not None and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        self._close_task = asyncio.create_task(self._close())
 
     async def disconnect(self):
-        await self._ws.close()
+        # Close after any pending messages (ie, a logout message) have been sent
+        if self._writer_task is None:
+            await self._close()
+        else:
+            self._queue.put_nowait(None)
 
     def __repr__(self):
         return f"Connection({self.user.username}, {self.addr})"
@@ -78,8 +166,15 @@ class ConnectionsBase(MessagesBase):
     def __init__(self):
         self.connections: dict[str, Connection] = {}
         self.user_ids_to_connections: defaultdict[int, set[Connection]] = defaultdict(set)
+        self.num_evicted = 0
+        # Connections across all API processes, so messages can be routed to ones this process doesn't hold
+        self.directory = ConnectionDirectory(self.name)
         super().__init__()
 
+    @property
+    def name(self):
+        return "admins" if self.is_admin else "users"
+
     @property
     def is_admin(self):
         raise NotImplementedError()
@@ -88,6 +183,15 @@ class ConnectionsBase(MessagesBase):
     def num_connections(self):
         return len(self.connections)
 
+    def get_backpressure_stats(self):
+        queued = [connection.queued for connection in self.connections.values()]
+        return {
+            "connections": len(queued),
+            "queued": sum(queued),
+            "max_queued": max(queued, default=0),
+            "evicted": self.num_evicted,
+        }
+
     async def hello(self, connection: Connection):
         pass
 
@@ -108,24 +212,26 @@ class ConnectionsBase(MessagesBase):
             if "sessionid" not in websocket.cookies:
                 raise TomatoAuthError("No sessionid cookie, can't complete session auth!")
             store = SessionStore(session_key=websocket.cookies["sessionid"])
-            lookup = {"id": await store.aget(SESSION_KEY)}
+            # Sessions live in the cache, so load them off of the thread sync_to_async() shares with the ORM
+            session = await sync_to_async(store.load, thread_sensitive=False)()
+            lookup = ("id", session.get(SESSION_KEY))
         else:
-            lookup = {"username": greeting["username"]}
+            lookup = ("username", greeting["username"])
 
         try:
-            user = await User.objects.aget(**lookup)
+            user = await get_user(*lookup)
         except User.DoesNotExist:
             pass
         else:
             if user.is_active and (not self.is_admin or await user.ahas_perm("tomato.configure_live_clients")):
                 if is_session:
-                    session_hash = await store.aget(HASH_SESSION_KEY)
+                    session_hash = session.get(HASH_SESSION_KEY)
                     if session_hash and await sync_to_async(constant_time_compare)(
                         session_hash, await sync_to_async(user.get_session_auth_hash)()
                     ):
-                        return Connection(websocket, user)
+                        return Connection(websocket, user, greeting)
                 elif await user.acheck_password(greeting["password"]):
-                    return Connection(websocket, user)
+                    return Connection(websocket, user, greeting)
         raise TomatoAuthError("Invalid username or password.", should_sleep=True, field="userpass")
 
     async def disconnect_user(self, user_id: int):
@@ -144,14 +250,27 @@ class ConnectionsBase(MessagesBase):
                 connection.user = user
         logger.debug(f"Refreshed {user}, {self.is_admin=}")
 
-    async def broadcast(self, message_type, message=None):
-        raw_message = django_json_dumps({"type": message_type, "data": message})  # No sense serializing more than once
-        for connection in self.connections.values():
+    async def broadcast(self, message_type, message=None, connections=None):
+        if connections is None:
+            connections = list(self.connections.values())
+        if connections:  # No sense serializing more than once (or at all, if there's no one to send to)
+            await self.broadcast_raw(django_json_dumps({"type": message_type, "data": message}), connections)
+
+    async def broadcast_raw(self, raw_message, connections=None):
+        if connections is None:
+            connections = list(self.connections.values())
+        for connection in connections:
             try:
                 await connection.send_raw(raw_message)
             except Exception:
                 logger.exception("Recoverable error while sending to websocket")
 
+    async def broadcast_global(self, message_type, message=None):
+        # Broadcast to connections in all API processes
+        raw_message = django_json_dumps({"type": message_type, "data": message})
+        await self.broadcast_raw(raw_message)
+        await self.route(raw_message)
+
     async def message_user(self, user_id: int, message_type, message=None):
         raw_message = django_json_dumps({"type": message_type, "data": message})  # No sense serializing more than once
         if user_id in self.user_ids_to_connections:
@@ -160,22 +279,56 @@ class ConnectionsBase(MessagesBase):
                     await connection.send_raw(raw_message)
                 except Exception:
                     logger.exception("Recoverable error while sending to websocket")
+        try:
+            if await self.directory.has_user(user_id, in_other_processes=True):
+                await self.route(raw_message, user_id=user_id)
+        except Exception:
+            logger.exception("Recoverable error while routing to other processes")
 
     async def message(self, connection_id: int, message_type, message=None):
         raw_message = django_json_dumps({"type": message_type, "data": message})  # No sense serializing more than once
         try:
-            connection = self.connections[connection_id]
-            await connection.send_raw(raw_message)
+            if connection_id in self.connections:
+                await self.connections[connection_id].send_raw(raw_message)
+            elif await self.directory.get(connection_id) is not None:
+                await self.route(raw_message, connection_id=connection_id)
+            else:
+                logger.warning(f"Can't message non-existent connection {connection_id=}, {self.is_admin=}")
         except Exception:
             logger.exception("Recoverable error while sending to websocket")
 
+    async def route(self, raw_message, *, connection_id=None, user_id=None):
+        await publish_server_messages([(
+            ServerMessageTypes.ROUTE,
+            {
+                "origin": PROCESS_ID,
+                "target": self.name,
+                "connection_id": connection_id,
+                "user_id": user_id,
+                "raw": raw_message,
+            },
+        )])
+
+    async def process_routed_message(self, message):
+        # Deliver a message routed from another API process to our local connections
+        if message["origin"] == PROCESS_ID:
+            return
+
+        if (connection_id := message["connection_id"]) is not None:
+            connections = [self.connections[connection_id]] if connection_id in self.connections else []
+        elif message["user_id"] is not None:
+            connections = list(self.user_ids_to_connections.get(message["user_id"], ()))
+        else:
+            connections = None  # All connections
+        await self.broadcast_raw(message["raw"], connections)
+
     async def authorize_and_process_new_websocket(self, greeting: dict, websocket: WebSocket):
         connection: Connection = await self.authorize(greeting, websocket)
 
         if (
             not self.is_admin
-            and connection.user.id in self.user_ids_to_connections
-            and await get_config_async("ONE_CLIENT_LOGIN_PER_ACCOUNT")
+            and await get_config("ONE_CLIENT_LOGIN_PER_ACCOUNT")
+            and await self.directory.has_user(connection.user.id)
         ):
             raise TomatoAuthError("Your user account is already logged in on another computer.")
 
@@ -183,23 +336,34 @@ class ConnectionsBase(MessagesBase):
             f"Authorized {'admin' if self.is_admin else 'user'} connection for {connection.user} [id={connection.id}]"
         )
 
-        await connection.send(
-            {"success": True, "admin_mode": self.is_admin, "user": connection.user.username, **SERVER_STATUS}
-        )
-        await self.hello(connection)
-        self.connections[connection.id] = connection
-        self.user_ids_to_connections[connection.user.id].add(connection)
-        await self.on_connect(connection)
+        connection.start_writer()
         try:
-            await self.run_for_connection(connection)
+            await connection.send(
+                {"success": True, "admin_mode": self.is_admin, "user": connection.user.username, **SERVER_STATUS}
+            )
+            await self.hello(connection)
+            await self.directory.add(connection)
+            self.connections[connection.id] = connection
+            self.user_ids_to_connections[connection.user.id].add(connection)
+            await self.on_connect(connection)
+            try:
+                await self.run_for_connection(connection)
+            finally:
+                del self.connections[connection.id]
+                await self.directory.remove(connection)
+                user_id = connection.user.id
+                self.user_ids_to_connections[user_id].remove(connection)
+                if len(self.user_ids_to_connections[user_id]) == 0:
+                    del self.user_ids_to_connections[user_id]
+                if connection.evicted:
+                    self.num_evicted += 1
+                logger.info(
+                    f"{'Admin' if self.is_admin else 'User'} {connection.user} disconnected [id={connection.id},"
+                    f" stats={connection.stats}]"
+                )
+                await self.on_disconnect(connection)
         finally:
-            del self.connections[connection.id]
-            user_id = connection.user.id
-            self.user_ids_to_connections[user_id].remove(connection)
-            if len(self.user_ids_to_connections[user_id]) == 0:
-                del self.user_ids_to_connections[user_id]
-            logger.info(f"{'Admin' if self.is_admin else 'User'} {connection.user} disconnected [id={connection.id}]")
-            await self.on_disconnect(connection)
+            await connection.stop_writer()
 
     async def process(self, connection, message_type, message):
         assert (
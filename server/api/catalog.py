@@ -0,0 +1,174 @@
+from collections import deque
+import gzip
+import json
+import logging
+from operator import itemgetter
+import uuid
+
+from tomato.utils import django_json_dumps
+
+
+logger = logging.getLogger(__name__)
+ENTITY_TYPES = ("assets", "rotators", "stopsets")
+PATCH_HISTORY_SIZE = 50  # Clients further behind than this get a full snapshot
+CATALOG_SNAPSHOT_REDIS_KEY = "tomato::catalog-snapshot"  # Latest encoded snapshot, for warm starting API processes
+
+
+def compute_patch(old_data, new_data):
+    patch = {}
+    for entity_type in ENTITY_TYPES:
+        old_entities = {entity["id"]: entity for entity in old_data[entity_type]}
+        new_entities = {entity["id"]: entity for entity in new_data[entity_type]}
+        patch[entity_type] = {
+            "added": [entity for id, entity in new_entities.items() if id not in old_entities],
+            "changed": [
+                entity for id, entity in new_entities.items() if id in old_entities and entity != old_entities[id]
+            ],
+            "removed": [id for id in old_entities if id not in new_entities],
+        }
+    if "config" in new_data and new_data["config"] != old_data.get("config"):
+        patch["config"] = new_data["config"]
+    return patch
+
+
+def compose_patches(patches):
+    # Squash a sequence of patches into one, keeping track of whether each entity existed before the first patch
+    config = None
+    entities = {entity_type: {} for entity_type in ENTITY_TYPES}
+    for patch in patches:
+        config = patch.get("config", config)
+        for entity_type in ENTITY_TYPES:
+            states = entities[entity_type]
+            for entity in patch[entity_type]["added"]:
+                existed, _ = states.get(entity["id"], (False, None))
+                states[entity["id"]] = (existed, entity)
+            for entity in patch[entity_type]["changed"]:
+                existed, _ = states.get(entity["id"], (True, None))
+                states[entity["id"]] = (existed, entity)
+            for id in patch[entity_type]["removed"]:
+                existed, _ = states.get(id, (True, None))
+                states[id] = (existed, None)
+
+    composed = {}
+    for entity_type, states in entities.items():
+        composed[entity_type] = {
+            "added": [entity for existed, entity in states.values() if not existed and entity is not None],
+            "changed": [entity for existed, entity in states.values() if existed and entity is not None],
+            "removed": [id for id, (existed, entity) in states.items() if existed and entity is None],
+        }
+    if config is not None:
+        composed["config"] = config
+    return composed
+
+
+class Catalog:
+    def __init__(self):
+        # Revisions are only meaningful within one epoch (ie, the lifetime of this process)
+        self.epoch = uuid.uuid4().hex
+        self.revision = 0
+        self.data = None
+        self.patches: deque[tuple[int, dict]] = deque(maxlen=PATCH_HISTORY_SIZE)
+        # Encoded snapshot messages, so reconnecting clients don't each cost a JSON encode of the whole catalog
+        self._encoded_snapshots: dict[tuple, str | bytes] = {}
+        # Revision ids of a snapshot we warm started from, which clients may still have -> our revision
+        self.revision_aliases: dict[str, int] = {}
+        # Warm started data went through JSON (ie, dates are strings), so fresh data needs the same to compare
+        self.is_decoded_snapshot = False
+
+    @property
+    def revision_id(self):
+        return f"{self.epoch}:{self.revision}"
+
+    def set_initial(self, data):
+        self.data = data
+        self.revision += 1
+        self.patches.clear()
+        self._encoded_snapshots.clear()
+        self.revision_aliases.clear()
+        self.is_decoded_snapshot = False
+
+    def load_encoded_snapshot(self, encoded):
+        """Warm start from get_encoded_snapshot(..., with_revision=True, gzipped=True) output of any API process"""
+        data = json.loads(gzip.decompress(encoded))["data"]
+        revision_id = data.pop("revision")
+        self.set_initial(data)
+        self.revision_aliases[revision_id] = self.revision
+        self.is_decoded_snapshot = True
+
+    def merge_changes(self, serialized_changes):
+        """Build new catalog data by merging serialize_changes_for_api() output into the current data"""
+        data = dict(self.data)
+        for entity_type in ENTITY_TYPES:
+            if entities := serialized_changes.get(entity_type):
+                entities_by_id = {entity["id"]: entity for entity in data[entity_type]}
+                for id, entity in entities.items():
+                    if entity is None:
+                        entities_by_id.pop(id, None)
+                    else:
+                        entities_by_id[id] = entity
+                data[entity_type] = sorted(entities_by_id.values(), key=itemgetter("id"))
+        if "config" in serialized_changes:
+            data["config"] = serialized_changes["config"]
+        return data
+
+    def update(self, data, *, complete=False):
+        """Update catalog to new data, returning a patch from the previous revision or None if no patch applies"""
+        if self.data is None:
+            self.set_initial(data)
+            return None
+
+        compare_data = data
+        if self.is_decoded_snapshot:
+            compare_data = json.loads(django_json_dumps(data))
+            if complete:
+                self.is_decoded_snapshot = False  # Everything is fresh from the DB from now on
+            else:
+                data = compare_data  # Merged with decoded data, so keep comparing like with like
+        if compare_data == self.data:
+            self.data = data
+            return None
+
+        patch = compute_patch(self.data, compare_data)
+        self.data = data
+        self.revision += 1
+        self._encoded_snapshots.clear()
+        self.patches.append((self.revision, patch))
+        logger.debug(f"Catalog updated to revision {self.revision}")
+        return patch
+
+    def get_patch_since(self, revision_id):
+        """Get a patch from revision_id to the current revision, or None if a full snapshot is needed"""
+        if revision_id in self.revision_aliases:
+            revision_id = f"{self.epoch}:{self.revision_aliases[revision_id]}"
+        try:
+            epoch, revision = revision_id.split(":")
+            revision = int(revision)
+        except (AttributeError, ValueError):
+            return None
+
+        if epoch != self.epoch or revision > self.revision:
+            return None
+        if revision == self.revision:
+            return compose_patches(())
+        if not self.patches or self.patches[0][0] > revision + 1:
+            return None  # Too old
+        return compose_patches(patch for patch_revision, patch in self.patches if patch_revision > revision)
+
+    def serialize_patch(self, patch, base_revision_id):
+        return {"revision": self.revision_id, "base_revision": base_revision_id, **patch}
+
+    def serialize_snapshot(self):
+        return {"revision": self.revision_id, **self.data}
+
+    def get_encoded_snapshot(self, message_type, *, with_revision=False, gzipped=False):
+        """Get the current snapshot as a raw websocket message, encoded at most once per revision"""
+        key = (message_type, with_revision, gzipped)
+        if key not in self._encoded_snapshots:
+            if gzipped:
+                raw_message = self.get_encoded_snapshot(message_type, with_revision=with_revision)
+                encoded = gzip.compress(raw_message.encode(), mtime=0)
+            else:
+                data = self.serialize_snapshot() if with_revision else self.data
+                encoded = django_json_dumps({"type": message_type, "data": data})
+            self._encoded_snapshots[key] = encoded
+        return self._encoded_snapshots[key]
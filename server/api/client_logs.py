@@ -0,0 +1,139 @@
+import asyncio
+import logging
+
+from django.db import connections
+
+from tomato.constants import CLIENT_LOG_ENTRY_TYPES
+from tomato.models import ClientLogEntry, PlayRollup
+
+from .base import Connection
+from .db import db_pool
+from .schemas import OutgoingUserMessageTypes
+
+
+logger = logging.getLogger(__name__)
+LOG_FLUSH_DELAY = 0.025  # Seconds to accumulate log entries before writing them in one go
+LOG_MAX_BATCH_SIZE = 500
+LOG_REFERENCE_FIELDS = ("asset_id", "rotator_id", "stopset_id")
+LOG_CLIENT_FIELDS = ("created_at", "type", "description", *LOG_REFERENCE_FIELDS)
+LOG_UPDATE_FIELDS = ("created_at", "created_by", "ip_address", "type", "description", "asset", "rotator", "stopset")
+MAX_REFERENCE_ID = 2**63 - 1  # bigint
+
+
+def build_log_entry(connection: Connection, id, data):
+    """Build an entry from a client's log message, raising ValidationError if it couldn't be written"""
+    kwargs = {field: data[field] for field in LOG_CLIENT_FIELDS if field in data}
+    if kwargs.get("type") not in CLIENT_LOG_ENTRY_TYPES:
+        kwargs["type"] = "unspecified"
+    for field in LOG_REFERENCE_FIELDS:
+        value = kwargs.get(field)
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= MAX_REFERENCE_ID:
+            kwargs.pop(field, None)
+    if isinstance(kwargs.get("description"), str):
+        kwargs["description"] = kwargs["description"].replace("\x00", "")  # Postgres can't store NUL characters
+
+    entry = ClientLogEntry(id=id, created_by=connection.user, ip_address=connection.addr, **kwargs)
+    # Normalizes values (ie, parses created_at), skipping relations since validating those queries the DB
+    entry.clean_fields(exclude=("created_by", "asset", "rotator", "stopset"))
+    return entry
+
+
+def get_upsert_query(entries):
+    # INSERT ... ON CONFLICT (id) DO UPDATE, with values prepared the same way as the ORM would
+    fields = ClientLogEntry._meta.concrete_fields
+    columns = ", ".join(field.column for field in fields)
+    updates = ", ".join(
+        f"{field.column} = EXCLUDED.{field.column}" for field in fields if field.name in LOG_UPDATE_FIELDS
+    )
+    values = ", ".join([f"({', '.join(['%s'] * len(fields))})"] * len(entries))
+    params = [
+        field.get_db_prep_save(getattr(entry, field.attname), connection=connections["default"])
+        for entry in entries
+        for field in fields
+    ]
+    return (
+        f"INSERT INTO {ClientLogEntry._meta.db_table} ({columns}) VALUES {values} ON CONFLICT (id) DO UPDATE SET"
+        f" {updates}",
+        params,
+    )
+
+
+class ClientLogWriter:
+    """Batches client log entries into a single upsert, acknowledging each entry after it's written"""
+
+    def __init__(self):
+        self.pending: dict[str, tuple[ClientLogEntry, Connection]] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._running_flushes: set[asyncio.Task] = set()
+
+    def add(self, connection: Connection, entry: ClientLogEntry):
+        self.pending[str(entry.id)] = (entry, connection)  # Same entry resent in one batch? Latest one wins.
+        if len(self.pending) >= LOG_MAX_BATCH_SIZE:
+            self._start_flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_delay())
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(LOG_FLUSH_DELAY)
+        self._start_flush()
+
+    def _start_flush(self):
+        batch, self.pending = self.pending, {}
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        if batch:
+            flush_task = asyncio.create_task(self.flush(batch))
+            self._running_flushes.add(flush_task)
+            flush_task.add_done_callback(self._running_flushes.discard)
+
+    async def write(self, batch):
+        # Returns the ids of entries that already existed
+        async with db_pool.cursor(f"write of {len(batch)} client logs", transaction=True) as cursor:
+            await cursor.execute(
+                f"SELECT id FROM {ClientLogEntry._meta.db_table} WHERE id = ANY(%s::uuid[])", (list(batch.keys()),)
+            )
+            existing_ids = {str(id) for id, in await cursor.fetchall()}
+            await cursor.execute(*get_upsert_query([entry for entry, _ in batch.values()]))
+
+            try:
+                # Resent entries were already counted the first time around
+                new_entries = [entry for id, (entry, _) in batch.items() if id not in existing_ids]
+                if query := PlayRollup.get_record_plays_query(new_entries):
+                    async with cursor.connection.transaction():  # Savepoint, so the logs get written regardless
+                        await cursor.execute(*query)
+            except Exception:
+                logger.exception("Error updating play rollups")
+        return existing_ids
+
+    async def flush(self, batch):
+        try:
+            existing_ids = await self.write(batch)
+        except Exception:
+            logger.exception(f"Error writing batch of {len(batch)} client logs")
+            if len(batch) == 1:
+                await self.acknowledge(batch, success=False)
+            else:
+                # Write entries one at a time, so only the ones that can't be written fail
+                for id, item in batch.items():
+                    await self.flush({id: item})
+            return
+
+        logger.info(f"Wrote batch of {len(batch)} client logs ({len(existing_ids)} existing)")
+        await self.acknowledge(batch, existing_ids=existing_ids)
+
+    async def acknowledge(self, batch, *, success=True, existing_ids=()):
+        for id, (entry, connection) in batch.items():
+            logger.debug(f"Acknowledged {entry.type} log {id} for {connection.user} ({success=})")
+            response = {"success": success, "id": id}
+            if success:
+                response.update({"updated_existing": id in existing_ids, "ignored": False})
+            await connection.message(OutgoingUserMessageTypes.ACKNOWLEDGE_LOG, response)
+
+    async def close(self):
+        self._start_flush()
+        if self._running_flushes:
+            await asyncio.wait(self._running_flushes)
+
+
+client_log_writer = ClientLogWriter()
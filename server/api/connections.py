@@ -1,12 +1,18 @@
 import asyncio
 import logging
 
-from tomato.constants import CLIENT_LOG_ENTRY_TYPES, HEARTBEAT_INTERVAL
-from tomato.models import ClientLogEntry, serialize_for_api
+from django.core.exceptions import ValidationError
+
+from tomato.constants import HEARTBEAT_INTERVAL
+from tomato.models import serialize_changes_for_api, serialize_for_api
 
 from .base import Connection, ConnectionsBase
+from .catalog import CATALOG_SNAPSHOT_REDIS_KEY, Catalog
+from .client_logs import build_log_entry, client_log_writer
+from .db import get_config
+from .directory import PROCESS_TTL, keep_process_alive
 from .schemas import AdminMessageTypes, OutgoingAdminMessageTypes, OutgoingUserMessageTypes, UserMessageTypes
-from .utils import get_config_async, retry_on_failure, task
+from .utils import get_redis, retry_on_failure, task
 
 
 logger = logging.getLogger(__name__)
@@ -21,15 +27,15 @@ class AdminConnections(ConnectionsBase):
         await self.update_user_connections(connection)
 
     async def on_disconnect(self, connection: Connection):
-        await users.broadcast(OutgoingAdminMessageTypes.UNSUBSCRIBE, {"connection_id": connection.id})
+        await users.broadcast_global(OutgoingAdminMessageTypes.UNSUBSCRIBE, {"connection_id": connection.id})
 
     async def update_user_connections(self, connection: Connection | None = None):
         msg = [
-            {"username": conn.user.username, "user_id": conn.user.id, "connection_id": id, "addr": conn.addr}
-            for id, conn in users.connections.items()
+            {"username": info["username"], "user_id": info["user_id"], "connection_id": id, "addr": info["addr"]}
+            for id, info in (await users.directory.all()).items()
         ]
         if connection is None:
-            await self.broadcast(self.OutgoingTypes.USER_CONNECTIONS, msg)
+            await self.broadcast_global(self.OutgoingTypes.USER_CONNECTIONS, msg)
         else:
             await connection.message(self.OutgoingTypes.USER_CONNECTIONS, msg)
 
@@ -43,7 +49,7 @@ class AdminConnections(ConnectionsBase):
             )
         else:
             logger.info("Reloading all playlists via admin request")
-            await users.broadcast(
+            await users.broadcast_global(
                 OutgoingUserMessageTypes.RELOAD_PLAYLIST,
                 {"notify": True, "connection_id": connection.id, "force": True},
             )
@@ -78,11 +84,36 @@ class UserConnections(ConnectionsBase):
     is_admin = False
 
     def __init__(self):
-        self.last_serialized_data = None
+        self.catalog = Catalog()
         super().__init__()
 
+    @property
+    def last_serialized_data(self):
+        return self.catalog.data
+
     async def hello(self, connection: Connection):
-        await connection.message(self.OutgoingTypes.DATA, self.last_serialized_data)
+        if connection.supports_data_patches:
+            patch = None
+            if connection.data_revision is not None:
+                patch = self.catalog.get_patch_since(connection.data_revision)
+            if patch is None:
+                logger.debug(f"Sending full data snapshot to {connection} (revision {connection.data_revision})")
+                await self.broadcast_snapshot([connection], with_revision=True)
+            else:
+                await connection.message(
+                    self.OutgoingTypes.DATA_PATCH, self.catalog.serialize_patch(patch, connection.data_revision)
+                )
+        else:
+            await self.broadcast_snapshot([connection])
+
+    async def broadcast_snapshot(self, connections, with_revision=False):
+        for gzipped in (False, True):
+            group = [connection for connection in connections if (connection.compression == "gzip") == gzipped]
+            if group:
+                raw_message = self.catalog.get_encoded_snapshot(
+                    self.OutgoingTypes.DATA, with_revision=with_revision, gzipped=gzipped
+                )
+                await self.broadcast_raw(raw_message, group)
 
     async def on_connect(self, connection: Connection):
         await admins.update_user_connections()
@@ -91,41 +122,91 @@ class UserConnections(ConnectionsBase):
         await admins.update_user_connections()
 
     async def init_last_serialized_data(self):
-        logger.info("Initializing serialized data for clients")
-        self.last_serialized_data = await retry_on_failure(serialize_for_api)
-
-    async def broadcast_data_change(self, force=False):
-        serialized_data = await serialize_for_api()
-        has_changed = serialized_data != self.last_serialized_data
+        try:
+            encoded = await get_redis().get(CATALOG_SNAPSHOT_REDIS_KEY)
+            if encoded is not None:
+                self.catalog.load_encoded_snapshot(encoded)
+        except Exception:
+            logger.exception("Error loading catalog snapshot from redis")
+
+        if self.catalog.data is None:
+            logger.info("Initializing serialized data for clients")
+            self.catalog.set_initial(await retry_on_failure(serialize_for_api))
+            await self.save_catalog_snapshot()
+        else:
+            logger.info("Warm started serialized data for clients from snapshot, refreshing in the background")
+            self.refresh_warm_started_data()
+
+    @task
+    async def refresh_warm_started_data(self):
+        await self.broadcast_data_change()
+
+    async def save_catalog_snapshot(self):
+        # So the next API process to start up (or replica) can greet clients without waiting on the DB
+        encoded = self.catalog.get_encoded_snapshot(self.OutgoingTypes.DATA, with_revision=True, gzipped=True)
+        try:
+            await get_redis().set(CATALOG_SNAPSHOT_REDIS_KEY, encoded)
+        except Exception:
+            logger.exception("Error saving catalog snapshot to redis")
+
+    async def broadcast_data_change(self, force=False, changes=None):
+        if changes is None or self.catalog.data is None:
+            serialized_data = await serialize_for_api()
+        else:
+            # Only re-query entities that changed
+            serialized_data = self.catalog.merge_changes(await serialize_changes_for_api(changes))
+        base_revision_id = self.catalog.revision_id
+        patch = self.catalog.update(serialized_data, complete=changes is None)
+        has_changed = self.catalog.revision_id != base_revision_id
+        if has_changed:
+            await self.save_catalog_snapshot()
         if force or has_changed:
-            await self.broadcast(self.OutgoingTypes.DATA, serialized_data)
-            if has_changed and await get_config_async("RELOAD_PLAYLIST_AFTER_DATA_CHANGES"):
+            legacy_connections, patch_connections = [], []
+            for connection in self.connections.values():
+                (patch_connections if connection.supports_data_patches else legacy_connections).append(connection)
+
+            await self.broadcast_snapshot(legacy_connections)
+            if patch is None or force:
+                await self.broadcast_snapshot(patch_connections, with_revision=True)
+            else:
+                await self.broadcast(
+                    self.OutgoingTypes.DATA_PATCH,
+                    self.catalog.serialize_patch(patch, base_revision_id),
+                    connections=patch_connections,
+                )
+            if has_changed and await get_config("RELOAD_PLAYLIST_AFTER_DATA_CHANGES"):
                 await self.broadcast(self.OutgoingTypes.RELOAD_PLAYLIST, {"notify": False, "force": False})
-            self.last_serialized_data = serialized_data
         else:
             logger.debug("No change to DB data. Not broadcasting.")
 
     async def process_log(self, connection: Connection, data):
+        await self.queue_log(connection, data)
+
+    async def process_log_batch(self, connection: Connection, data):
+        # Lets clients replay their backlog of logs after being offline in one message
+        for log in data["logs"]:
+            await self.queue_log(connection, log)
+
+    async def queue_log(self, connection: Connection, data):
         uuid = data.pop("id")
-        if connection.user.enable_client_logs or data["type"] == "internal_error":
-            data.update({
-                "created_by": connection.user,
-                "ip_address": connection.addr,
-            })
-
-            if data["type"] not in CLIENT_LOG_ENTRY_TYPES:
-                data["type"] = "unspecified"
-            _, created = await ClientLogEntry.objects.aupdate_or_create(id=uuid, defaults=data)
-            logger.info(f"Acknowledged {data['type']} log {uuid} for {connection.user}, {created=}")
-            response = {"success": True, "id": uuid, "updated_existing": not created, "ignored": False}
+        if connection.user.enable_client_logs or data.get("type") == "internal_error":
+            try:
+                entry = build_log_entry(connection, uuid, data)
+            except ValidationError as e:
+                # Rejected up front, so one bad entry can't fail the whole batch it would have been written in
+                logger.warning(f"Rejected invalid log {uuid} for {connection.user}: {e.messages}")
+                await connection.message(self.OutgoingTypes.ACKNOWLEDGE_LOG, {"success": False, "id": uuid})
+                return
+            # Acknowledged once the writer flushes it to the DB
+            client_log_writer.add(connection, entry)
         else:
-            logger.info(f"Ignored {data['type']} log {uuid} for {connection.user}")
+            logger.info(f"Ignored {data.get('type')} log {uuid} for {connection.user}")
             response = {"success": True, "id": uuid, "updated_existing": False, "ignored": True}
-        return (self.OutgoingTypes.ACKNOWLEDGE_LOG, response)
+            await connection.message(self.OutgoingTypes.ACKNOWLEDGE_LOG, response)
 
     async def process_unsubscribe(self, connection: Connection, data):
         # Tell all admins user has unsubscribed
-        await admins.broadcast(OutgoingAdminMessageTypes.UNSUBSCRIBE, {"connection_id": connection.id})
+        await admins.broadcast_global(OutgoingAdminMessageTypes.UNSUBSCRIBE, {"connection_id": connection.id})
 
     async def process_client_data(self, connection: Connection, data):
         # Receive client data (which means we're subscribed)
@@ -149,3 +230,18 @@ async def send_connection_heartbeats():
         await asyncio.sleep(HEARTBEAT_INTERVAL)
         await users.broadcast(OutgoingUserMessageTypes.PING)
         await admins.broadcast(OutgoingAdminMessageTypes.PING)
+        for name, connections in (("user", users), ("admin", admins)):
+            stats = connections.get_backpressure_stats()
+            logger.log(logging.INFO if stats["queued"] else logging.DEBUG, f"Outbound {name} queue stats: {stats}")
+
+
+@task
+async def maintain_connection_directory():
+    while True:
+        await keep_process_alive()
+        num_pruned = 0
+        for connections in (users, admins):
+            num_pruned += await connections.directory.prune()
+        if num_pruned:
+            await admins.update_user_connections()
+        await asyncio.sleep(PROCESS_TTL / 3)
@@ -0,0 +1,102 @@
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+import logging
+import time
+
+import psycopg
+from psycopg.pq import TransactionStatus
+
+from django.conf import settings
+
+from constance import settings as constance_settings
+from constance.codecs import loads
+from constance.models import Constance
+
+from tomato.models import User
+
+
+logger = logging.getLogger(__name__)
+SLOW_QUERY_THRESHOLD = 0.5  # Seconds, queries slower than this get logged as warnings
+# Django specific database OPTIONS, the rest are passed through to libpq (ie, sslmode)
+DJANGO_DATABASE_OPTIONS = ("assume_role", "isolation_level", "pool", "server_side_binding")
+
+
+class AsyncDatabasePool:
+    """Native async psycopg connections for the API's hot queries, so they run concurrently rather than one at a time
+    on the single thread Django's async ORM shims use"""
+
+    def __init__(self, size):
+        self.size = size
+        # Held while a connection is checked out, so a discarded connection frees a slot for a waiter to reconnect
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle: list[psycopg.AsyncConnection] = []
+
+    async def _connect(self):
+        db = settings.DATABASES["default"]
+        options = {key: value for key, value in db.get("OPTIONS", {}).items() if key not in DJANGO_DATABASE_OPTIONS}
+        return await psycopg.AsyncConnection.connect(
+            host=db["HOST"],
+            port=db["PORT"],
+            dbname=db["NAME"],
+            user=db["USER"],
+            password=db["PASSWORD"],
+            autocommit=True,
+            **options,
+        )
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self._semaphore:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.closed or conn.broken or conn.info.transaction_status != TransactionStatus.IDLE:
+                    logger.warning("Discarding broken database connection from pool")
+                    await conn.close()
+                else:
+                    self._idle.append(conn)
+
+    @asynccontextmanager
+    async def cursor(self, name, *, transaction=False):
+        async with AsyncExitStack() as stack:
+            conn = await stack.enter_async_context(self.connection())
+            start = time.perf_counter()
+            try:
+                if transaction:
+                    await stack.enter_async_context(conn.transaction())
+                yield await stack.enter_async_context(conn.cursor())
+            finally:
+                elapsed = time.perf_counter() - start
+                log = logger.warning if elapsed >= SLOW_QUERY_THRESHOLD else logger.debug
+                log(f"Database {name} took {elapsed * 1000:.1f}ms")
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+async def get_user(lookup_field, value):
+    fields = User._meta.concrete_fields
+    columns = ", ".join(field.column for field in fields)
+    column = User._meta.get_field(lookup_field).column
+    async with db_pool.cursor("user lookup") as cursor:
+        await cursor.execute(f"SELECT {columns} FROM {User._meta.db_table} WHERE {column} = %s", (value,))
+        row = await cursor.fetchone()
+    if row is None:
+        raise User.DoesNotExist
+    return User.from_db("default", [field.attname for field in fields], row)
+
+
+async def get_config(key):
+    # Rather than through constance, whose reads go through the single thread sync_to_async() shares with everything
+    prefixed_key = f"{constance_settings.DATABASE_PREFIX}{key}"
+    async with db_pool.cursor("config lookup") as cursor:
+        await cursor.execute(f"SELECT value FROM {Constance._meta.db_table} WHERE key = %s", (prefixed_key,))
+        row = await cursor.fetchone()
+    if row is None or row[0] is None:
+        return settings.CONSTANCE_CONFIG[key][0]  # Not set, so the default
+    return loads(row[0])
+
+
+db_pool = AsyncDatabasePool(settings.API_DB_POOL_SIZE)
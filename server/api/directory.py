@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import socket
+
+from .utils import PROCESS_ID, get_redis
+
+
+logger = logging.getLogger(__name__)
+REDIS_CONNECTIONS_KEY_PREFIX = "tomato::api::connections"
+REDIS_PROCESS_KEY_PREFIX = "tomato::api::process"
+PROCESS_TTL = 30  # Seconds, connections of processes that haven't checked in for this long are pruned
+# Two live processes can't share a host and pid, so entries with ours but another process id are from a dead one
+PROCESS_INSTANCE = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_process_key(process_id):
+    return f"{REDIS_PROCESS_KEY_PREFIX}::{process_id}"
+
+
+async def keep_process_alive():
+    await get_redis().set(get_process_key(PROCESS_ID), 1, ex=PROCESS_TTL)
+
+
+async def get_live_process_ids(process_ids):
+    process_ids = list(process_ids)
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for process_id in process_ids:
+            pipe.exists(get_process_key(process_id))
+        exists = await pipe.execute()
+    return {process_id for process_id, alive in zip(process_ids, exists) if alive}
+
+
+async def forget_process():
+    # On clean shutdown, so other processes prune our connections right away
+    try:
+        await get_redis().delete(get_process_key(PROCESS_ID))
+    except Exception:
+        logger.exception("Error removing process from connection directory")
+
+
+class ConnectionDirectory:
+    """Redis-backed registry of websocket connections across all API processes"""
+
+    def __init__(self, name):
+        self.key = f"{REDIS_CONNECTIONS_KEY_PREFIX}::{name}"
+
+    async def add(self, connection):
+        info = {
+            "process_id": PROCESS_ID,
+            "process_instance": PROCESS_INSTANCE,
+            "user_id": connection.user.id,
+            "username": connection.user.username,
+            "addr": connection.addr,
+        }
+        await get_redis().hset(self.key, connection.id, json.dumps(info))
+
+    async def remove(self, connection):
+        try:
+            await get_redis().hdel(self.key, connection.id)
+        except Exception:
+            logger.exception(f"Error removing {connection} from connection directory")
+
+    async def all_including_dead(self) -> dict[str, dict]:
+        connections = await get_redis().hgetall(self.key)
+        return {connection_id.decode(): json.loads(info) for connection_id, info in connections.items()}
+
+    async def all(self) -> dict[str, dict]:
+        # Skip connections of dead processes, even before they've been pruned
+        connections = await self.all_including_dead()
+        live_process_ids = await get_live_process_ids({info["process_id"] for info in connections.values()})
+        return {id: info for id, info in connections.items() if info["process_id"] in live_process_ids}
+
+    async def get(self, connection_id) -> dict | None:
+        info = await get_redis().hget(self.key, connection_id)
+        if info is not None:
+            info = json.loads(info)
+            if await get_live_process_ids([info["process_id"]]):
+                return info
+        return None
+
+    async def has_user(self, user_id, *, in_other_processes=False):
+        return any(
+            info["user_id"] == user_id and not (in_other_processes and info["process_id"] == PROCESS_ID)
+            for info in (await self.all()).values()
+        )
+
+    async def prune(self, *, at_startup=False):
+        # Remove connections belonging to processes that died without cleaning up after themselves
+        connections = await self.all_including_dead()
+        process_ids = {info["process_id"] for info in connections.values()}
+        dead_process_ids = process_ids - await get_live_process_ids(process_ids)
+        if at_startup:
+            # A previous incarnation of this process (ie, crashed and restarted) may not have expired yet
+            dead_process_ids.update(
+                info["process_id"]
+                for info in connections.values()
+                if info.get("process_instance") == PROCESS_INSTANCE and info["process_id"] != PROCESS_ID
+            )
+        dead_connection_ids = [id for id, info in connections.items() if info["process_id"] in dead_process_ids]
+        if dead_connection_ids:
+            logger.warning(f"Pruning {len(dead_connection_ids)} connections of {len(dead_process_ids)} dead processes")
+            await get_redis().hdel(self.key, *dead_connection_ids)
+        return len(dead_connection_ids)
@@ -6,18 +6,21 @@ from schema import Optional, Or, Schema, Use
 class ServerMessageTypes(enum.StrEnum):
     DB_CHANGE = "db-change"
     LOGOUT = "logout"
+    ROUTE = "route"
 
 
 class UserMessageTypes(enum.StrEnum):
     ACK_ACTION = "ack-action"
     CLIENT_DATA = "client-data"
     SEND_LOG = "log"
+    SEND_LOG_BATCH = "log-batch"
     UNSUBSCRIBE = "unsubscribe"
 
 
 class OutgoingUserMessageTypes(enum.StrEnum):
     ACKNOWLEDGE_LOG = "ack-log"
     DATA = "data"
+    DATA_PATCH = "data-patch"
     LOGOUT = "logout"
     NOTIFY = "notify"
     PLAY = "play"
@@ -58,6 +61,9 @@ greeting_schema = Schema(
             "protocol_version": Use(int),
             Optional("admin_mode", default=False): Use(bool),
             Optional("method", default="text"): "text",
+            Optional("data_patches", default=False): Use(bool),
+            Optional("data_revision", default=None): Or(None, str),
+            Optional("compression", default=None): Or(None, "gzip"),
         },
         {
             "tomato": "radio-automation",
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import math
@@ -5,6 +6,12 @@ import math
 import redis.asyncio as redis
 
 from tomato.constants import REDIS_MESSAGES_PUBSUB_KEY
+from tomato.utils import (
+    NOTIFY_API_DEBOUNCE_LOCK_KEY,
+    NOTIFY_API_DEBOUNCE_QUEUE_KEY,
+    coalesce_db_changes,
+    concise_json_dumps,
+)
 
 from .base import MessagesBase
 from .connections import admins, users
@@ -22,8 +29,13 @@ class ServerMessages(MessagesBase):
 
     async def process_db_change(self, message):
         force = message.get("force", False)
-        logger.debug(f"Got DB change message {force=}")
-        await users.broadcast_data_change(force=force)
+        changes = message.get("changes")
+        logger.debug(f"Got DB change message {force=} {changes=}")
+        await users.broadcast_data_change(force=force, changes=changes)
+
+    async def process_route(self, message):
+        connections = admins if message["target"] == admins.name else users
+        await connections.process_routed_message(message)
 
     async def process_logout(self, message):
         admin_only = message.get("admin_only", False)
@@ -34,17 +46,44 @@ class ServerMessages(MessagesBase):
                 await users.disconnect_user(user_id)
             await admins.disconnect_user(user_id)
 
+    async def flush_abandoned_debounced_db_changes(self, conn):
+        # Debounced db-changes are normally flushed by whoever queued them first. If the lock expired and they're still
+        # queued, that process failed to or died before it could, so publish them to all API processes ourselves.
+        async with conn.pipeline() as pipe:
+            pipe.exists(NOTIFY_API_DEBOUNCE_LOCK_KEY)
+            pipe.llen(NOTIFY_API_DEBOUNCE_QUEUE_KEY)
+            is_locked, num_queued = await pipe.execute()
+        if is_locked or not num_queued:
+            return
+
+        async with conn.pipeline() as pipe:
+            pipe.lrange(NOTIFY_API_DEBOUNCE_QUEUE_KEY, 0, -1)
+            pipe.delete(NOTIFY_API_DEBOUNCE_QUEUE_KEY)
+            queued, _ = await pipe.execute()
+        if queued:  # Another API process may have beaten us to it
+            logger.warning(f"Flushing {len(queued)} debounced DB change notification(s) that were abandoned")
+            messages = coalesce_db_changes([json.loads(message) for message in queued])
+            await conn.publish(REDIS_MESSAGES_PUBSUB_KEY, concise_json_dumps(messages))
+
     @task
     async def consume_redis_notifications(self):
         conn = redis.Redis(host="redis")
+        loop = asyncio.get_running_loop()
 
         async with conn.pubsub() as pubsub:
             await pubsub.subscribe(REDIS_MESSAGES_PUBSUB_KEY)
             logger.info(f"Subscribed to redis pubsubs key {REDIS_MESSAGES_PUBSUB_KEY!r}")
 
+            db_changes = []  # Collected until the dedupe window closes, then processed as one
+            window_ends = None
+            num_timeouts_with_no_messages = 0
+
             while True:
-                redis_message = await pubsub.get_message(ignore_subscribe_messages=True)
+                timeout = DB_QUEUE_DEDUPE_TIMEOUT if window_ends is None else max(window_ends - loop.time(), 0)
+                # Blocks until a message arrives or timeout, rather than spinning
+                redis_message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
                 if redis_message:
+                    num_timeouts_with_no_messages = 0
                     notifications = json.loads(redis_message["data"])
                     for notification in notifications:
                         if isinstance(notification, str):
@@ -53,7 +92,28 @@ class ServerMessages(MessagesBase):
                             message_type, message = notification
 
                         logger.debug(f"Got redis notification: {message_type}: ({message=!r}")
-                        await self.process(message_type, message or {})
+                        if message_type == self.Types.DB_CHANGE:
+                            db_changes.append(notification)
+                            if window_ends is None:
+                                window_ends = loop.time() + DB_QUEUE_DEDUPE_TIMEOUT
+                        else:
+                            await self.process(message_type, message or {})  # Routed messages can't wait
+
+                elif window_ends is None:
+                    await self.flush_abandoned_debounced_db_changes(conn)
+                    num_timeouts_with_no_messages += 1
+                    if num_timeouts_with_no_messages >= DB_QUEUE_NUM_DEDUPE_TIMEOUTS_WITH_NO_MESSAGES_BEFORE_REFRESH:
+                        # Safety net in case a notification went missing, only broadcast if something changed
+                        logger.debug("No DB changes in a while, refreshing data")
+                        num_timeouts_with_no_messages = 0
+                        await self.process(self.Types.DB_CHANGE, {})
+
+                if window_ends is not None and loop.time() >= window_ends:
+                    [db_change] = coalesce_db_changes(db_changes)
+                    message = None if isinstance(db_change, str) else db_change[1]
+                    logger.debug(f"Processing {len(db_changes)} DB change notification(s) as one")
+                    db_changes, window_ends = [], None
+                    await self.process(self.Types.DB_CHANGE, message or {})
 
 
 server_messages = ServerMessages()
@@ -0,0 +1,98 @@
+from django.test import SimpleTestCase
+
+from ..catalog import Catalog, compose_patches
+
+
+def make_data(assets=(), rotators=(), stopsets=(), config=None):
+    data = {"assets": list(assets), "rotators": list(rotators), "stopsets": list(stopsets)}
+    if config is not None:
+        data["config"] = config
+    return data
+
+
+def make_patch(added=(), changed=(), removed=(), config=None):
+    patch = {entity_type: {"added": [], "changed": [], "removed": []} for entity_type in ("rotators", "stopsets")}
+    patch["assets"] = {"added": list(added), "changed": list(changed), "removed": list(removed)}
+    if config is not None:
+        patch["config"] = config
+    return patch
+
+
+class ComposePatchesTests(SimpleTestCase):
+    def test_empty(self):
+        self.assertEqual(compose_patches(()), make_patch())
+
+    def test_added_then_changed_is_added(self):
+        composed = compose_patches([make_patch(added=[{"id": 1, "v": 1}]), make_patch(changed=[{"id": 1, "v": 2}])])
+        self.assertEqual(composed, make_patch(added=[{"id": 1, "v": 2}]))
+
+    def test_added_then_removed_is_nothing(self):
+        composed = compose_patches([make_patch(added=[{"id": 1}]), make_patch(removed=[1])])
+        self.assertEqual(composed, make_patch())
+
+    def test_removed_then_added_is_changed(self):
+        composed = compose_patches([make_patch(removed=[1]), make_patch(added=[{"id": 1, "v": 2}])])
+        self.assertEqual(composed, make_patch(changed=[{"id": 1, "v": 2}]))
+
+    def test_changed_then_removed_is_removed(self):
+        composed = compose_patches([make_patch(changed=[{"id": 1, "v": 2}]), make_patch(removed=[1])])
+        self.assertEqual(composed, make_patch(removed=[1]))
+
+    def test_latest_config_wins(self):
+        composed = compose_patches([make_patch(config={"a": 1}), make_patch(), make_patch(config={"a": 2})])
+        self.assertEqual(composed, make_patch(config={"a": 2}))
+
+
+class CatalogPatchTests(SimpleTestCase):
+    def setUp(self):
+        self.catalog = Catalog()
+        self.catalog.update(make_data(assets=[{"id": 1, "v": 1}], config={"a": 1}))
+        self.initial_revision_id = self.catalog.revision_id
+
+    def test_current_revision_gets_empty_patch(self):
+        self.assertEqual(self.catalog.get_patch_since(self.initial_revision_id), make_patch())
+
+    def test_patch_since_composes_updates(self):
+        self.catalog.update(make_data(assets=[{"id": 1, "v": 2}, {"id": 2}], config={"a": 1}))
+        self.catalog.update(make_data(assets=[{"id": 2}], config={"a": 2}))
+        self.assertEqual(
+            self.catalog.get_patch_since(self.initial_revision_id),
+            make_patch(added=[{"id": 2}], removed=[1], config={"a": 2}),
+        )
+
+    def test_unchanged_data_keeps_revision(self):
+        self.assertIsNone(self.catalog.update(make_data(assets=[{"id": 1, "v": 1}], config={"a": 1})))
+        self.assertEqual(self.catalog.revision_id, self.initial_revision_id)
+
+    def test_unknown_revisions_need_snapshot(self):
+        epoch, revision = self.initial_revision_id.split(":")
+        for revision_id in (
+            None,
+            "garbage",
+            f"{epoch}:nope",
+            f"other-epoch:{revision}",
+            f"{epoch}:{int(revision) + 1}",
+        ):
+            with self.subTest(revision_id=revision_id):
+                self.assertIsNone(self.catalog.get_patch_since(revision_id))
+
+    def test_too_old_revision_needs_snapshot(self):
+        self.catalog.patches = type(self.catalog.patches)(maxlen=2)
+        for v in range(2, 5):
+            self.catalog.update(make_data(assets=[{"id": 1, "v": v}]))
+        self.assertIsNone(self.catalog.get_patch_since(self.initial_revision_id))
+        epoch, revision = self.catalog.revision_id.split(":")
+        self.assertEqual(
+            self.catalog.get_patch_since(f"{epoch}:{int(revision) - 2}"), make_patch(changed=[{"id": 1, "v": 4}])
+        )
+
+    def test_warm_started_revision_aliases(self):
+        encoded = self.catalog.get_encoded_snapshot("data", with_revision=True, gzipped=True)
+        warm_catalog = Catalog()
+        warm_catalog.load_encoded_snapshot(encoded)
+        self.assertEqual(warm_catalog.get_patch_since(self.initial_revision_id), make_patch())
+
+        warm_catalog.update(make_data(assets=[{"id": 1, "v": 2}], config={"a": 1}), complete=True)
+        self.assertEqual(
+            warm_catalog.get_patch_since(self.initial_revision_id), make_patch(changed=[{"id": 1, "v": 2}])
+        )
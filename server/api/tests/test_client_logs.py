@@ -0,0 +1,82 @@
+import datetime
+from types import SimpleNamespace
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+
+from tomato.models import ClientLogEntry
+
+from ..client_logs import build_log_entry, get_upsert_query
+
+
+CREATED_AT = datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+class GetUpsertQueryTests(SimpleTestCase):
+    def test_query(self):
+        entries = [
+            ClientLogEntry(id=uuid.uuid4(), created_at=CREATED_AT, type="played_asset", asset_id=1),
+            ClientLogEntry(id=uuid.uuid4(), created_at=CREATED_AT, ip_address="10.0.0.1", description="hi"),
+        ]
+        sql, params = get_upsert_query(entries)
+
+        columns = [field.column for field in ClientLogEntry._meta.concrete_fields]
+        row = f"({', '.join(['%s'] * len(columns))})"
+        self.assertTrue(
+            sql.startswith(
+                f"INSERT INTO {ClientLogEntry._meta.db_table} ({', '.join(columns)}) VALUES {row}, {row} ON CONFLICT"
+            )
+        )
+        updates = sql.split(" ON CONFLICT (id) DO UPDATE SET ")[1].split(", ")
+        self.assertEqual(updates, [f"{column} = EXCLUDED.{column}" for column in columns if column != "id"])
+
+        self.assertEqual(len(params), 2 * len(columns))
+        first, second = params[: len(columns)], params[len(columns) :]
+        self.assertEqual(
+            dict(zip(columns, first)),
+            {
+                "id": entries[0].id,
+                "ip_address": None,
+                "created_at": CREATED_AT,
+                "created_by_id": None,
+                "type": "played_asset",
+                "description": "",
+                "asset_id": 1,
+                "rotator_id": None,
+                "stopset_id": None,
+            },
+        )
+        self.assertEqual(second[columns.index("id")], entries[1].id)
+        self.assertEqual(str(second[columns.index("ip_address")]), "10.0.0.1")  # Adapted for postgres
+
+
+class BuildLogEntryTests(SimpleTestCase):
+    connection = SimpleNamespace(user=None, addr="127.0.0.1")
+
+    def test_normalizes_client_data(self):
+        id = uuid.uuid4()
+        entry = build_log_entry(
+            self.connection,
+            id,
+            {
+                "created_at": "2026-10-18T12:00:00Z",
+                "type": "not-a-type",
+                "description": "a\x00b",
+                "asset_id": 5,
+                "rotator_id": True,
+                "stopset_id": 2**63,
+                "ip_address": "6.6.6.6",  # Not the client's to set
+            },
+        )
+        self.assertEqual(entry.id, id)
+        self.assertEqual(entry.created_at, CREATED_AT)
+        self.assertEqual(entry.type, "unspecified")
+        self.assertEqual(entry.description, "ab")
+        self.assertEqual((entry.asset_id, entry.rotator_id, entry.stopset_id), (5, None, None))
+        self.assertEqual(entry.ip_address, "127.0.0.1")
+
+    def test_invalid_entries_raise(self):
+        for data in ({"created_at": "not a date"}, {"created_at": None}):
+            with self.subTest(data=data), self.assertRaises(ValidationError):
+                build_log_entry(self.connection, uuid.uuid4(), data)
@@ -2,23 +2,34 @@ import asyncio
 from functools import wraps
 import logging
 import random
+import uuid
 
-from asgiref.sync import sync_to_async
+import redis.asyncio as redis
 
 from django.conf import settings
 
 from uvicorn.logging import ColourizedFormatter
 
-from constance import config
+from tomato.constants import REDIS_MESSAGES_PUBSUB_KEY
+from tomato.utils import concise_json_dumps
 
 
 # Various base classes
 logger = logging.getLogger(__name__)
+PROCESS_ID = uuid.uuid4().hex  # Unique per API process (ie, uvicorn worker or container)
+_redis = None
 
 
-@sync_to_async
-def get_config_async(key):
-    return getattr(config, key)
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(host="redis")
+    return _redis
+
+
+async def publish_server_messages(notifications: list):
+    # Same format tomato.utils.notify_api_multiple() publishes, consumed by every API process
+    await get_redis().publish(REDIS_MESSAGES_PUBSUB_KEY, concise_json_dumps(notifications))
 
 
 class TomatoAuthError(Exception):
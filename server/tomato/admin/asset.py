@@ -1,15 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from pathlib import Path
-import tempfile
 import urllib.parse
-import zipfile
 
 from django import forms
+from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin.helpers import ActionForm
 from django.contrib.admin.widgets import FilteredSelectMultiple, RelatedFieldWidgetWrapper
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
@@ -23,13 +24,33 @@ from django_file_form.model_admin import FileFormAdminMixin
 
 from ..models import Asset, AssetAlternate, Rotator
 from ..tasks import bulk_process_assets, process_asset
-from .base import NO_ICON, YES_ICON, AiringFilter, AiringMixin, NoNullRelatedOnlyFieldFilter, TomatoModelAdminBase
+from ..utils import stream_zip
+from .base import (
+    NO_ICON,
+    YES_ICON,
+    AiringFilter,
+    AiringMixin,
+    NoNullRelatedOnlyFieldFilter,
+    PlayCountsMixin,
+    TomatoModelAdminBase,
+)
 
 
 logger = logging.getLogger(__name__)
 DOWNLOAD_FOLDER_NAME_PREFIX = "tomato-assets"
 
 
+def validate_uploaded_asset(asset):
+    # Runs in a pool thread, returning the validation error (if any)
+    try:
+        asset.full_clean(exclude={"original_filename"})
+    except forms.ValidationError as validation_error:
+        return validation_error
+    finally:
+        connection.close()  # Each pool thread gets its own DB connection
+    return None
+
+
 class AssetActionForm(ActionForm):
     rotator = forms.ModelChoiceField(Rotator.objects.all(), required=False, label=" ", empty_label="--- Rotator ---")
 
@@ -202,9 +223,10 @@ class AssetAdminBase(FileFormAdminMixin, TomatoModelAdminBase):
         ] + super().get_urls()
 
 
-class AssetAdmin(AiringMixin, AssetAdminBase):
+class AssetAdmin(PlayCountsMixin, AiringMixin, AssetAdminBase):
     ROTATORS_FIELDSET = ("Rotators", {"fields": ("rotators",)})
     NAME_AIRING_FIELDSET = (None, {"fields": ("name", "airing")})
+    PLAY_HISTORY_FIELDSET = ("Play history", {"fields": ("num_plays", "last_aired")})
 
     add_fieldsets = (
         (None, {"fields": ("name",)}),
@@ -229,6 +251,7 @@ class AssetAdmin(AiringMixin, AssetAdminBase):
         ("Audio file", {"fields": ("file", "filename_display", "file_display", "duration", "alternates_display")}),
         ROTATORS_FIELDSET,
         AiringMixin.AIRING_INFO_FIELDSET,
+        PLAY_HISTORY_FIELDSET,
         AssetAdminBase.ADDITIONAL_INFO_FIELDSET,
         ("Danger Zone", {"fields": ("archived",)}),
     )
@@ -242,6 +265,8 @@ class AssetAdmin(AiringMixin, AssetAdminBase):
         "weight",
         "duration",
         "rotators_display",
+        "num_plays",
+        "last_aired",
         "created_at",
         "comment_display",
     )
@@ -255,15 +280,23 @@ class AssetAdmin(AiringMixin, AssetAdminBase):
         ("created_by", NoNullRelatedOnlyFieldFilter),
     )
     list_prefetch_related = ("rotators", "alternates")
+    play_counts_field = "asset"
     search_fields = ("name", "original_filename")
     no_change_fieldsets = (
         NAME_AIRING_FIELDSET,
         ("Audio file", {"fields": ("filename_display", "file_display", "duration", "alternates_display_readonly")}),
         ("Rotators", {"fields": ("rotators_display",)}),
         AiringMixin.AIRING_INFO_FIELDSET,
+        PLAY_HISTORY_FIELDSET,
         AssetAdminBase.ADDITIONAL_INFO_FIELDSET,
     )
-    readonly_fields = ("airing", "alternates_display", "rotators_display") + AssetAdminBase.readonly_fields
+    readonly_fields = (
+        "airing",
+        "alternates_display",
+        "rotators_display",
+        "num_plays",
+        "last_aired",
+    ) + AssetAdminBase.readonly_fields
 
     def change_view(self, request, object_id, form_url="", extra_context=None):
         asset = get_object_or_404(Asset, id=object_id)
@@ -398,25 +431,22 @@ class AssetAdmin(AiringMixin, AssetAdminBase):
             return current_try
 
         if len(assets) >= 1:
-            file = tempfile.NamedTemporaryFile("wb+")
             export_folder = Path(f"{DOWNLOAD_FOLDER_NAME_PREFIX}-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}")
             export_zip_filename = export_folder.with_suffix(".zip")
-            zip = zipfile.ZipFile(file, "w")
-
-            for n, asset in enumerate(assets, 1):
-                logger.info(f"Exporting {n}/{len(assets)} assets...")
-                suffix = Path(asset.file.path).suffix
-                filename = get_unique_filename(asset.original_filename)
-                zip.write(asset.file.path, export_folder / f"{filename}{suffix}")
-                for alternate in filter(lambda alt: alt.status == alt.Status.READY, asset.alternates.all()):
-                    alt_filename = get_unique_filename(alternate.original_filename)
-                    zip.write(alternate.file.path, export_folder / f"{alt_filename}{suffix}")
-
-            zip.close()
-            logger.info("Export done!")
-            file.seek(0)  # Go back to beginning of file
-            return HttpResponse(
-                file,
+
+            def entries():
+                for n, asset in enumerate(assets, 1):
+                    logger.info(f"Exporting {n}/{len(assets)} assets...")
+                    suffix = Path(asset.file.path).suffix
+                    filename = get_unique_filename(asset.original_filename)
+                    yield (export_folder / f"{filename}{suffix}", asset.file.path)
+                    for alternate in filter(lambda alt: alt.status == alt.Status.READY, asset.alternates.all()):
+                        alt_filename = get_unique_filename(alternate.original_filename)
+                        yield (export_folder / f"{alt_filename}{suffix}", alternate.file.path)
+                logger.info("Export done!")
+
+            return StreamingHttpResponse(
+                stream_zip(entries()),
                 content_type="application/octet-stream",
                 headers={"Content-Disposition": f'attachment; filename="{export_zip_filename}"'},
             )
@@ -434,15 +464,15 @@ class AssetAdmin(AiringMixin, AssetAdminBase):
             if form.is_valid():
                 files = request.FILES.getlist("files")
                 rotators = form.cleaned_data.get("rotators")
-                assets = []
+                assets = [Asset(file=audio_file, created_by=request.user) for audio_file in files]
 
-                for audio_file in files:
-                    asset = Asset(file=audio_file, created_by=request.user)
-                    assets.append(asset)
+                # Validation probes and decodes every file, so do it concurrently
+                num_workers = max(1, min(settings.BULK_PROCESS_ASSETS_WORKERS, len(assets)))
+                with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="upload_view") as executor:
+                    validation_errors = list(executor.map(validate_uploaded_asset, assets))
 
-                    try:
-                        asset.full_clean(exclude={"original_filename"})
-                    except forms.ValidationError as validation_error:
+                for audio_file, validation_error in zip(files, validation_errors):
+                    if validation_error is not None:
                         for field, error_list in validation_error:
                             for error in error_list:
                                 form.add_error(
@@ -7,7 +7,7 @@ from django.utils.formats import date_format as django_date_format
 from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
-from ..models import Asset, Stopset
+from ..models import Asset, PlayRollup, Stopset
 
 
 YES_ICON = static("admin/img/icon-yes.svg")
@@ -120,6 +120,22 @@ class NumAssetsMixin:
         return format_html_join(mark_safe("<br>\n"), "&#x25cf; {}", display)
 
 
+class PlayCountsMixin:
+    # Play counts come from the incrementally maintained rollup table rather than scanning client logs
+    play_counts_field = None
+
+    def get_queryset(self, request):
+        return PlayRollup.annotate_queryset_with_plays(super().get_queryset(request), self.play_counts_field)
+
+    @admin.display(description="Plays", ordering="num_plays")
+    def num_plays(self, obj):
+        return obj.num_plays
+
+    @admin.display(description="Last aired", ordering="last_aired_at")
+    def last_aired(self, obj):
+        return format_datetime(obj.last_aired_at) if obj.last_aired_at else mark_safe("<em>never</em>")
+
+
 class TomatoModelAdminBase(ListPrefetchRelatedMixin, SaveCreatedByMixin, admin.ModelAdmin):
     add_fieldsets = None
     list_max_show_all = 5000
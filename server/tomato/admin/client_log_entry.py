@@ -1,10 +1,12 @@
 import csv
+import datetime
 
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.urls import path
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.safestring import mark_safe
 
 from ..models import ClientLogEntry
@@ -17,7 +19,7 @@ class CSVBuffer:
 
 
 class ClientLogEntryAdmin(ListPrefetchRelatedMixin, admin.ModelAdmin):
-    actions = ("csv",)
+    actions = ("csv", "ndjson")
     date_hierarchy = "created_at"
     empty_value_display = "Unknown / deleted"
     fields = ("id", "created_at_display", "category", "type", "created_by", "ip_address", "description_display")
@@ -48,34 +50,65 @@ class ClientLogEntryAdmin(ListPrefetchRelatedMixin, admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False
 
-    @admin.action(description=f"Export selected {ClientLogEntry._meta.verbose_name_plural} as CSV")
-    def csv(self, request, queryset):
-        filename = f"tomato-client-log-entries-{timezone.localtime().strftime('%Y%M%S%H%M%S')}.csv"
-        response = HttpResponse(
-            content_type="text/csv",
+    def export_response(self, queryset, format):
+        filename = f"tomato-client-log-entries-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}"
+        if format == "ndjson":
+            filename, content_type, content = f"{filename}.ndjson.gz", "application/gzip", queryset.export_ndjson_gz()
+        else:
+            filename, content_type, content = f"{filename}.csv", "text/csv", self.csv_rows(queryset)
+
+        return StreamingHttpResponse(
+            content,
+            content_type=content_type,
             headers={"Content-Disposition": f'attachment; filename="{filename}"'},
         )
 
-        writer = csv.writer(response, quoting=csv.QUOTE_ALL)
-        writer.writerow(("ID", "Created At", "Category", "Type", "Created By", "Description"))
-
-        for entry in queryset.order_by("created_at").prefetch_related("created_by"):
-            writer.writerow((
-                str(entry.id),
-                timezone.localtime(entry.created_at).strftime("%Y/%m/%d %H:%M:%S"),
-                entry.category(),
-                entry.type,
-                "unknown/deleted" if entry.created_by is None else entry.created_by.username,
-                entry.description,
+    def csv_rows(self, queryset):
+        writer = csv.writer(CSVBuffer(), quoting=csv.QUOTE_ALL)
+        yield writer.writerow((
+            "ID",
+            "Created At",
+            "Category",
+            "Type",
+            "Created By",
+            "Description",
+            "Asset ID",
+            "Rotator ID",
+            "Stop Set ID",
+        ))
+
+        for id, created_at, type, username, _, description, *ref_ids in queryset.export_rows():
+            yield writer.writerow((
+                str(id),
+                timezone.localtime(created_at).strftime("%Y/%m/%d %H:%M:%S"),
+                ClientLogEntry.CATEGORIES.get(type, "unspecified"),
+                type,
+                "unknown/deleted" if username is None else username,
+                description,
+                *("" if ref_id is None else ref_id for ref_id in ref_ids),
             ))
 
-        return response
+    @admin.action(description=f"Export selected {ClientLogEntry._meta.verbose_name_plural} as CSV")
+    def csv(self, request, queryset):
+        return self.export_response(queryset, "csv")
+
+    @admin.action(description=f"Export selected {ClientLogEntry._meta.verbose_name_plural} as gzipped NDJSON")
+    def ndjson(self, request, queryset):
+        return self.export_response(queryset, "ndjson")
 
     def csv_view(self, request):
         if not self.has_view_permission(request):
             raise PermissionDenied
 
-        return self.csv(request, ClientLogEntry.objects.all())
+        # Optional date range, ie ?since=2025-01-01&until=2025-01-31 (inclusive)
+        start = end = None
+        if since := parse_date(request.GET.get("since") or ""):
+            start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+        if until := parse_date(request.GET.get("until") or ""):
+            end = timezone.make_aware(datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time.min))
+
+        queryset = ClientLogEntry.objects.created_between(start, end)
+        return self.export_response(queryset, request.GET.get("format", "csv"))
 
     def get_urls(self):
         return [
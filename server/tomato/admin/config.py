@@ -4,7 +4,7 @@ from constance.admin import Config, ConstanceAdmin as ConstanceConfigAdmin
 from constance.apps import ConstanceConfig
 from constance.forms import ConstanceForm as OriginalConstanceForm
 
-from ..utils import notify_api
+from ..utils import notify_api_db_change
 
 
 Config._meta.verbose_name = Config._meta.verbose_name_plural = "configuration"
@@ -18,7 +18,7 @@ class ConstanceForm(OriginalConstanceForm):
     def save(self):
         super().save()
         logger.debug("Constance config was saved in admin UI, notifying API")
-        notify_api()
+        notify_api_db_change({"config": True})
 
 
 class ConfigAdmin(ConstanceConfigAdmin):
@@ -3,10 +3,16 @@ from django.urls import reverse
 from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
-from .base import AiringEnabledMixin, NoNullRelatedOnlyFieldFilter, NumAssetsMixin, TomatoModelAdminBase
+from .base import (
+    AiringEnabledMixin,
+    NoNullRelatedOnlyFieldFilter,
+    NumAssetsMixin,
+    PlayCountsMixin,
+    TomatoModelAdminBase,
+)
 
 
-class RotatorAdmin(AiringEnabledMixin, NumAssetsMixin, TomatoModelAdminBase):
+class RotatorAdmin(PlayCountsMixin, AiringEnabledMixin, NumAssetsMixin, TomatoModelAdminBase):
     actions = (
         "enable",
         "disable",
@@ -23,8 +29,11 @@ class RotatorAdmin(AiringEnabledMixin, NumAssetsMixin, TomatoModelAdminBase):
         "color_display",
         "stopsets_display",
         "num_assets",
+        "num_plays",
+        "last_aired",
     )
     list_prefetch_related = ("stopsets",)
+    play_counts_field = "rotator"
     COLOR_FIELDSET = ("Color", {"fields": ("color", "color_preview")})
     add_fieldsets = (
         (None, {"fields": ("name", "is_single_play", "evenly_cycle")}),
@@ -35,11 +44,17 @@ class RotatorAdmin(AiringEnabledMixin, NumAssetsMixin, TomatoModelAdminBase):
         ("Airing Information", {"fields": ("enabled", "is_single_play", "evenly_cycle")}),
         COLOR_FIELDSET,
         ("Stop sets", {"fields": ("stopsets_display",)}),
-        ("Additional information", {"fields": ("num_assets", "created_by", "created_at")}),
+        ("Additional information", {"fields": ("num_assets", "num_plays", "last_aired", "created_by", "created_at")}),
     )
     # Average asset length?
     # Assets
-    readonly_fields = ("stopsets_display", "color_preview", "num_assets") + TomatoModelAdminBase.readonly_fields
+    readonly_fields = (
+        "stopsets_display",
+        "color_preview",
+        "num_assets",
+        "num_plays",
+        "last_aired",
+    ) + TomatoModelAdminBase.readonly_fields
     list_filter = (
         "enabled",
         "stopsets",
@@ -1,11 +1,13 @@
+import datetime
 import logging
-import tempfile
 
 from django import forms
 from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.views.generic import TemplateView
 
 from django_file_form.forms import FileFormMixin, UploadedFileField
@@ -46,18 +48,19 @@ class AdminAssetDataView(AdminViewMixin, TemplateView):
         }
 
     def do_export(self):
-        zip_file = tempfile.NamedTemporaryFile("wb+")
-        zip_filename = export_data_as_zip(zip_file)
-        zip_file.seek(0)  # Go back to beginning of file
-        return HttpResponse(
-            zip_file,
+        since = None
+        if since_date := parse_date(self.request.POST.get("since") or ""):
+            since = timezone.make_aware(datetime.datetime.combine(since_date, datetime.time.min))
+        zip_filename, zip_chunks = export_data_as_zip(since=since)
+        return StreamingHttpResponse(
+            zip_chunks,
             content_type="application/octet-stream",
             headers={"Content-Disposition": f'attachment; filename="{zip_filename}"'},
         )
 
-    def do_import(self, file):
+    def do_import(self, file, merge=False):
         try:
-            info = import_data_from_zip(file, created_by=self.request.user)
+            info = import_data_from_zip(file, created_by=self.request.user, merge=merge)
         except ImportTomatoDataException as e:
             self.message_user(f"Import error: {e}", messages.ERROR)
         except Exception as e:
@@ -80,10 +83,11 @@ class AdminAssetDataView(AdminViewMixin, TemplateView):
         context = self.get_context_data(**kwargs)
         can_import, can_delete = context["can_import"], context["can_delete"]
         action = self.request.POST.get("action")
-        if can_import and action == "import":
+        if action == "import":
             if context["import_upload_form"].is_valid():
                 uploaded_file = context["import_upload_form"].cleaned_data["file"]
-                return self.do_import(uploaded_file)
+                # Import into existing data by merging
+                return self.do_import(uploaded_file, merge=not can_import)
         elif action == "export":
             return self.do_export()
         elif can_delete and action == "delete":
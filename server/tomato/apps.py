@@ -7,12 +7,18 @@ from django.db import models
 from django.db.models import signals
 
 from .constants import EDIT_ALL_GROUP_NAME, EDIT_ONLY_ASSETS_GROUP_NAME
-from .utils import notify_api
+from .utils import notify_api_db_change
 
 
-def m2m_changed(action: str, sender: models.Model, **kwargs):
+def m2m_changed(action: str, sender: models.Model, instance: models.Model, pk_set: set | None, **kwargs):
     if action.startswith("post_") and sender._meta.db_table in ("asset_rotators", "stopset_rotators"):
-        notify_api()
+        entity_type = "assets" if sender._meta.db_table == "asset_rotators" else "stopsets"
+        if instance._meta.db_table == entity_type:
+            notify_api_db_change({entity_type: [instance.pk]})
+        elif pk_set is not None:
+            notify_api_db_change({entity_type: sorted(pk_set)})
+        else:
+            notify_api_db_change()  # Cleared from the rotator side, so we don't know which entities changed
 
 
 class TomatoConfig(AppConfig):
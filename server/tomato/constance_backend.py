@@ -0,0 +1,87 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import OperationalError, ProgrammingError, transaction
+
+from constance.backends.database import DatabaseBackend
+from constance.codecs import loads
+from django_redis import get_redis_connection
+
+from .constants import REDIS_CONSTANCE_INVALIDATE_PUBSUB_KEY
+
+
+logger = logging.getLogger(__name__)
+INVALIDATION_LISTENER_RETRY_DELAY = 1  # Seconds
+
+
+class CachedDatabaseBackend(DatabaseBackend):
+    """Database backend serving reads from a process-local snapshot of all config values, loaded with one query and
+    invalidated via redis pubsub whenever any process sets a value"""
+
+    def __init__(self):
+        super().__init__()
+        self._snapshot = None
+        self._generation = 0  # Bumped on invalidation, so a load racing with a change isn't kept
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    def _listen_for_invalidations(self):
+        while True:
+            try:
+                pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REDIS_CONSTANCE_INVALIDATE_PUBSUB_KEY)
+                self.invalidate()  # We may have missed messages while (re)connecting
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        logger.debug("Constance config changed, invalidating snapshot")
+                        self.invalidate()
+            except Exception:
+                logger.exception("Error listening for constance config invalidations, retrying")
+                self.invalidate()
+                time.sleep(INVALIDATION_LISTENER_RETRY_DELAY)
+
+    def _ensure_listener(self):
+        # Started lazily (and again after a fork), since threads don't survive forking. Called with the lock held,
+        # so this resets the snapshot itself rather than via invalidate().
+        if self._listener_pid != os.getpid():
+            self._listener_pid = os.getpid()
+            self._snapshot = None
+            self._generation += 1
+            threading.Thread(target=self._listen_for_invalidations, daemon=True).start()
+
+    def get_snapshot(self):
+        with self._lock:
+            self._ensure_listener()
+            snapshot, generation = self._snapshot, self._generation
+        if snapshot is None:
+            # Not using mget(), since it returns nothing on database errors and that mustn't be cached
+            keys = {self.add_prefix(key): key for key in settings.CONSTANCE_CONFIG}
+            try:
+                stored = self._model._default_manager.filter(key__in=keys).values_list("key", "value")
+                snapshot = {keys[key]: loads(value) for key, value in stored}
+            except (OperationalError, ProgrammingError) as e:  # ie, before migrations have run
+                logger.warning(f"Error loading constance config, using defaults until next read: {e}")
+                return {}
+            with self._lock:
+                if self._generation == generation:
+                    self._snapshot = snapshot
+        return snapshot
+
+    def get(self, key):
+        return self.get_snapshot().get(key)  # None means not set, so constance uses the default
+
+    def set(self, key, value):
+        super().set(key, value)
+        self.invalidate()
+        transaction.on_commit(self.publish_invalidation)
+
+    def publish_invalidation(self):
+        get_redis_connection().publish(REDIS_CONSTANCE_INVALIDATE_PUBSUB_KEY, "")
@@ -14,6 +14,7 @@ COLORS = _data["colors"]
 COLORS_DICT = {c["name"]: {k: c[k] for k in c.keys() if k != "name"} for c in COLORS}
 
 REDIS_MESSAGES_PUBSUB_KEY = "tomato::notify-api"
+REDIS_CONSTANCE_INVALIDATE_PUBSUB_KEY = "tomato::constance-invalidate"
 
 EDIT_ONLY_ASSETS_GROUP_NAME = "Edit ONLY audio assets"
 EDIT_ALL_GROUP_NAME = "Edit audio assets, rotators & stop sets"
@@ -1,5 +1,6 @@
 from collections import namedtuple
 import datetime
+import hashlib
 import json
 import logging
 import math
@@ -7,12 +8,25 @@ import re
 import shlex
 import subprocess
 
+from django.core.cache import cache
+
 from constance import config
 
 
 logger = logging.getLogger(__name__)
 FFProbe = namedtuple("FFProbe", ("format", "duration", "title"))
-SILENCEDETECT_RE = re.compile(r"^\[silencedetect.+silence_duration: ([\d\.]+)", re.MULTILINE)
+SILENCEDETECT_END_RE = re.compile(
+    r"^\[silencedetect.+silence_end: ([\d\.]+) \| silence_duration: ([\d\.]+)", re.MULTILINE
+)
+ANALYZE_AUDIO_CACHE_TIMEOUT = 60 * 60 * 24
+ANALYZE_AUDIO_MIN_SILENCE = 1  # Shortest silence recorded, REJECT_SILENCE_LENGTH is at least one second when enabled
+
+
+class AudioAnalysis(namedtuple("AudioAnalysis", ("md5sum", "format", "duration", "title", "silences"))):
+    # silences are (start, duration) tuples in seconds, None if the audio wasn't decoded
+    @property
+    def longest_silence(self):
+        return max((duration for _, duration in self.silences or ()), default=0)
 
 
 def run_command(args):
@@ -20,6 +34,16 @@ def run_command(args):
     return subprocess.run(args, text=True, capture_output=True)
 
 
+def md5sum_file(infile):
+    md5sum = hashlib.md5()
+
+    with open(infile, "rb") as file:
+        while chunk := file.read(1024 * 128):
+            md5sum.update(chunk)
+
+    return md5sum.digest()
+
+
 def ffprobe(infile):
     # We want at least one audio channel
     cmd = run_command((
@@ -59,8 +83,16 @@ def ffprobe(infile):
     return FFProbe(title=title, **kwargs)
 
 
-def ffmpeg_convert(infile, outfile):
-    # May create multiple files in outfile' directory, so it should be removed
+# Equivalent to sox's "silence 1 0.1 0.1% reverse silence 1 0.1 0.1% reverse", without intermediate WAV files.
+# Note: areverse buffers the decoded audio in memory rather than on disk.
+TRIM_SILENCE_FILTER = ",".join(
+    ["silenceremove=start_periods=1:start_duration=0.1:start_threshold=0.001", "areverse"] * 2
+)
+
+
+def ffmpeg_convert(infile, outfile, *, single_pass=True):
+    # With single_pass=False (the older sox path, kept for benchmarking), may create multiple files in outfile'
+    # directory, so it should be removed
 
     if not outfile.name.lower().endswith(".mp3"):
         raise Exception("Will only convert to MP3")
@@ -83,7 +115,9 @@ def ffmpeg_convert(infile, outfile):
         "0:a:0",
     ])
 
-    if config.TRIM_SILENCE:
+    if config.TRIM_SILENCE and single_pass:
+        base_args.extend(["-af", TRIM_SILENCE_FILTER])
+    elif config.TRIM_SILENCE:
         trimmed_wav_file = outfile.with_suffix(".wav")
         untrimmed_wav_file = trimmed_wav_file.with_stem(f"{outfile.stem}-untrimmed")
 
@@ -121,38 +155,56 @@ def ffmpeg_convert(infile, outfile):
     if cmd.returncode != 0:
         logger.error(f"ffmpeg (final) returned {cmd.returncode}: {cmd.stderr}")
 
-    if config.TRIM_SILENCE:
+    if config.TRIM_SILENCE and not single_pass:
         trimmed_wav_file.unlink(missing_ok=True)
 
     return cmd.returncode == 0
 
 
-def silence_detect(infile):
-    if config.REJECT_SILENCE_LENGTH == 0:
-        return (False, 0)
-
-    cmd = run_command(
-        (
-            "ffmpeg",
-            "-y",
-            "-i",
-            infile,
-            "-hide_banner",
-            "-af",
-            f"silencedetect=n=-32dB:d={config.REJECT_SILENCE_LENGTH}",
-            "-f",
-            "null",
-            "-",
-        ),
-    )
+def analyze_audio(infile, *, decode=True):
+    # Probe, plus a full decode for silences when asked for, cached by content so validation and processing can share
+    # it. Header-only ffprobe is used for format and tags, since ffmpeg doesn't report them in a parseable way.
+    md5sum = md5sum_file(infile)
+    cache_key = f"analyze-audio:{md5sum.hex()}"
+    analysis = cache.get(cache_key)
+    if analysis is not None and (analysis.silences is not None or not decode):
+        logger.info(f"Using cached audio analysis for {infile}")
+        return analysis
+
+    if analysis is None:
+        if not (ffprobe_data := ffprobe(infile)):
+            return None
+        analysis = AudioAnalysis(md5sum=md5sum, silences=None, **ffprobe_data._asdict())
+    if not decode:
+        cache.set(cache_key, analysis, timeout=ANALYZE_AUDIO_CACHE_TIMEOUT)
+        return analysis
+
+    cmd = run_command((
+        "ffmpeg",
+        "-i",
+        infile,
+        "-hide_banner",
+        "-nostats",
+        "-map",
+        "0:a:0",
+        "-af",
+        f"silencedetect=n=-32dB:d={ANALYZE_AUDIO_MIN_SILENCE}",
+        "-f",
+        "null",
+        "-",
+    ))
     if cmd.returncode != 0:
-        logger.error(f"ffmpeg returned {cmd.returncode} while detecting silence in {infile}: {cmd.stderr}")
-        return (False, 0)
-
-    silences = SILENCEDETECT_RE.findall(cmd.stderr)
-    if silences:
-        max_silence = max(math.ceil(float(s)) for s in SILENCEDETECT_RE.findall(cmd.stderr))
-        logger.warning(f"{infile} has a silence of {max_silence} seconds in it!")
-        return (True, max_silence)
-    else:
-        return (False, 0)
+        # A failed decode doesn't count as silence, but don't cache it
+        logger.error(f"ffmpeg returned {cmd.returncode} while analyzing {infile}: {cmd.stderr}")
+        return analysis._replace(silences=())
+
+    analysis = analysis._replace(
+        silences=tuple(
+            (float(end) - float(duration), float(duration))
+            for end, duration in SILENCEDETECT_END_RE.findall(cmd.stderr)
+        )
+    )
+    if analysis.longest_silence:
+        logger.warning(f"{infile} has a silence of {analysis.longest_silence} seconds in it!")
+    cache.set(cache_key, analysis, timeout=ANALYZE_AUDIO_CACHE_TIMEOUT)
+    return analysis
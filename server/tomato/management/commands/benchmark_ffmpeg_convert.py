@@ -0,0 +1,75 @@
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from constance import config
+
+from tomato.ffmpeg import ffmpeg_convert
+
+
+DISK_POLL_INTERVAL = 0.05
+
+
+def get_dir_size(dirname):
+    size = 0
+    for entry in os.scandir(dirname):
+        try:
+            size += entry.stat().st_size
+        except FileNotFoundError:
+            pass  # Deleted while we were looking
+    return size
+
+
+class Command(BaseCommand):
+    help = "Compare wall time and peak temporary disk use of the single-pass and sox silence trimming conversions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", type=Path, help="Audio files to convert.")
+        parser.add_argument("-r", "--runs", type=int, default=3, help="Number of runs per file and mode.")
+
+    def convert(self, infile, single_pass):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            peak_disk_use = 0
+            done = threading.Event()
+
+            def poll_disk_use():
+                nonlocal peak_disk_use
+                while not done.is_set():
+                    peak_disk_use = max(peak_disk_use, get_dir_size(temp_dir))
+                    done.wait(DISK_POLL_INTERVAL)
+
+            poller = threading.Thread(target=poll_disk_use)
+            poller.start()
+            start = time.perf_counter()
+            try:
+                succeeded = ffmpeg_convert(infile, Path(temp_dir) / "out.mp3", single_pass=single_pass)
+            finally:
+                elapsed = time.perf_counter() - start
+                done.set()
+                poller.join()
+        return succeeded, elapsed, peak_disk_use
+
+    def handle(self, *args, **options):
+        if not config.TRIM_SILENCE:
+            self.stdout.write(self.style.WARNING("TRIM_SILENCE is off, so both modes do the same thing"))
+
+        for infile in options["files"]:
+            self.stdout.write(f"{infile} ({os.path.getsize(infile) / 1024 / 1024:.1f}MB):")
+            for mode, single_pass in (("sox", False), ("single-pass", True)):
+                times, peak_disk_use = [], 0
+                for _ in range(options["runs"]):
+                    succeeded, elapsed, disk_use = self.convert(infile, single_pass)
+                    if not succeeded:
+                        self.stdout.write(self.style.ERROR(f"  {mode}: conversion failed"))
+                        break
+                    times.append(elapsed)
+                    peak_disk_use = max(peak_disk_use, disk_use)
+                else:
+                    self.stdout.write(
+                        f"  {mode:>11}: best {min(times):.2f}s, mean {sum(times) / len(times):.2f}s,"
+                        f" peak disk use {peak_disk_use / 1024 / 1024:.1f}MB"
+                    )
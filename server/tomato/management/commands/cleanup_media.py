@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from tomato.models import SavedAssetFile
+
+
+class Command(BaseCommand):
+    help = "Delete files in the media directory that no longer belong to any asset, resuming the last pass"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n", "--dry-run", action="store_true", help="Report unreferenced files without deleting them."
+        )
+        parser.add_argument("-m", "--max-files", type=int, help="Stop after scanning this many files.")
+        parser.add_argument(
+            "-r", "--restart", action="store_true", help="Start from the beginning instead of resuming the last pass."
+        )
+
+    def handle(self, *args, dry_run, max_files, restart, **options):
+        report = SavedAssetFile.cleanup_unreferenced_files(dry_run=dry_run, max_files=max_files, restart=restart)
+
+        for path in report["unreferenced"]:
+            self.stdout.write(f"{'Would delete' if dry_run else 'Deleted'}: {path}")
+        if report["resumed_after"]:
+            self.stdout.write(f"Resumed after {report['resumed_after']}")
+        self.stdout.write(
+            f"Scanned {report['scanned']} files, {len(report['unreferenced'])} unreferenced"
+            f" ({filesizeformat(report['bytes'])}), {report['in_grace_period']} skipped as too new"
+        )
+        if report["next_cursor"] is None:
+            self.stdout.write(self.style.SUCCESS("Finished a full pass of the media directory."))
+        else:
+            self.stdout.write(f"Stopped after {report['next_cursor']}, run again to continue.")
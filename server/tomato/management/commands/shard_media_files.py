@@ -0,0 +1,121 @@
+import os
+from pathlib import Path
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from tomato.models import Asset, AssetAlternate, SavedAssetFile
+from tomato.models.asset import shard_asset_filename
+from tomato.utils import notify_api_db_change
+
+
+MODEL_CLASSES = (Asset, AssetAlternate, SavedAssetFile)
+UNLINK_CHECK_CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Move asset files from the flat media directory into the sharded layout in batches. Safe to run while the"
+        " server is up, and to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-b", "--batch-size", type=int, default=500, help="Files to move per transaction.")
+        parser.add_argument("-n", "--dry-run", action="store_true", help="Only report how many files would move.")
+        parser.add_argument(
+            "-d",
+            "--unlink-delay",
+            type=int,
+            default=300,
+            help=(
+                "Seconds to keep old filenames around after the last batch, for clients still downloading them. If"
+                " interrupted, the media cleanup task removes them later."
+            ),
+        )
+
+    def get_unsharded_queryset(self, model_cls):
+        queryset = model_cls.objects.exclude(file="").exclude(file__contains="/")
+        if model_cls is not SavedAssetFile:
+            # Processing saves the whole asset when it's done, which would write back the old name, so skip these
+            # (they can be moved by running again later)
+            queryset = queryset.filter(status=model_cls.Status.READY)
+        return queryset
+
+    def get_unsharded_files(self, batch_size):
+        files = set()
+        for model_cls in MODEL_CLASSES:
+            files.update(
+                self.get_unsharded_queryset(model_cls).order_by("file").values_list("file", flat=True)[:batch_size]
+            )
+        return sorted(files)[:batch_size]
+
+    def get_referenced_files(self, files):
+        referenced = set()
+        for i in range(0, len(files), UNLINK_CHECK_CHUNK_SIZE):
+            chunk = files[i : i + UNLINK_CHECK_CHUNK_SIZE]
+            for model_cls in MODEL_CLASSES:
+                referenced.update(model_cls.objects.filter(file__in=chunk).values_list("file", flat=True))
+        return referenced
+
+    def link_file(self, media_root, name, new_name):
+        old_path, new_path = media_root / name, media_root / new_name
+        new_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(old_path, new_path)  # Hard link, so the file is served under both names until the DB is updated
+        except FileExistsError:
+            if not os.path.samefile(old_path, new_path):
+                raise CommandError(f"{new_path} already exists and isn't {old_path}!")
+        except FileNotFoundError:
+            if not new_path.exists():
+                self.stderr.write(self.style.WARNING(f"{old_path} is missing, updating its name anyway"))
+                return None
+        return old_path
+
+    def handle(self, *args, batch_size, dry_run, unlink_delay, **options):
+        if dry_run:
+            for model_cls in MODEL_CLASSES:
+                num = self.get_unsharded_queryset(model_cls).count()
+                self.stdout.write(f"{num} {model_cls._meta.verbose_name_plural} would be moved")
+            return
+
+        media_root = Path(settings.MEDIA_ROOT)
+        old_names = []
+        last_updated = time.monotonic()
+
+        while batch := self.get_unsharded_files(batch_size):
+            renames = {name: shard_asset_filename(name) for name in batch}
+            for name, new_name in renames.items():
+                if self.link_file(media_root, name, new_name):
+                    old_names.append(name)
+
+            file_case = Case(*(When(file=name, then=Value(new_name)) for name, new_name in renames.items()))
+            with transaction.atomic():
+                asset_ids = set(
+                    self.get_unsharded_queryset(Asset).filter(file__in=renames.keys()).values_list("id", flat=True)
+                )
+                asset_ids.update(
+                    self.get_unsharded_queryset(AssetAlternate)
+                    .filter(file__in=renames.keys())
+                    .values_list("asset_id", flat=True)
+                )
+                for model_cls in MODEL_CLASSES:
+                    self.get_unsharded_queryset(model_cls).filter(file__in=renames.keys()).update(file=file_case)
+            notify_api_db_change({"assets": sorted(asset_ids)})  # Clients pick up the new URLs
+            last_updated = time.monotonic()
+            self.stdout.write(f"Moved {len(renames)} files ({len(old_names)} so far)")
+
+        if old_names:
+            if (remaining := unlink_delay - (time.monotonic() - last_updated)) > 0:
+                self.stdout.write(f"Waiting {remaining:.0f}s for clients to switch to the new URLs...")
+                time.sleep(remaining)
+            # Anything that started processing in the meantime may have written an old name back, so keep those
+            still_referenced = self.get_referenced_files(old_names)
+            for name in old_names:
+                if name in still_referenced:
+                    self.stderr.write(self.style.WARNING(f"{name} is referenced again, keeping it"))
+                else:
+                    (media_root / name).unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(f"Done. Moved {len(old_names)} files into the sharded layout."))
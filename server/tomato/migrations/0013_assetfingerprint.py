@@ -0,0 +1,67 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_fingerprints(apps, schema_editor):
+    AssetFingerprint = apps.get_model("tomato", "AssetFingerprint")
+    for model_name, field in (("Asset", "asset"), ("AssetAlternate", "alternate")):
+        model_cls = apps.get_model("tomato", model_name)
+        AssetFingerprint.objects.bulk_create(
+            (
+                AssetFingerprint(md5sum=md5sum, **{f"{field}_id": id})
+                for id, md5sum in model_cls.objects.filter(pre_process_md5sum__isnull=False)
+                .values_list("id", "pre_process_md5sum")
+                .iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tomato", "0012_remove_pgtrigger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AssetFingerprint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("md5sum", models.BinaryField(db_index=True, max_length=16)),
+                (
+                    "alternate",
+                    models.OneToOneField(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fingerprint",
+                        to="tomato.assetalternate",
+                    ),
+                ),
+                (
+                    "asset",
+                    models.OneToOneField(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fingerprint",
+                        to="tomato.asset",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "asset_fingerprints",
+                "constraints": [
+                    models.CheckConstraint(
+                        condition=models.Q(
+                            models.Q(("alternate__isnull", True), ("asset__isnull", False)),
+                            models.Q(("alternate__isnull", False), ("asset__isnull", True)),
+                            _connector="OR",
+                        ),
+                        name="asset_fingerprint_asset_xor_alternate",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_fingerprints, migrations.RunPython.noop),
+    ]
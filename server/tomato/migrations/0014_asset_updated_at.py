@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tomato", "0013_assetfingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="asset",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name="updated at"
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="assetalternate",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name="updated at"
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:00
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tomato", "0014_asset_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="clientlogentry",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="clientlogentry",
+            index=django.contrib.postgres.indexes.BrinIndex(fields=["created_at"], name="logs_created_at_brin"),
+        ),
+        migrations.AddIndex(
+            model_name="clientlogentry",
+            index=models.Index(fields=["created_at", "id"], name="logs_created_at_id"),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tomato", "0015_clientlogentry_brin_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="clientlogentry",
+            name="asset",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="tomato.asset",
+            ),
+        ),
+        migrations.AddField(
+            model_name="clientlogentry",
+            name="rotator",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="tomato.rotator",
+            ),
+        ),
+        migrations.AddField(
+            model_name="clientlogentry",
+            name="stopset",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="tomato.stopset",
+            ),
+        ),
+        migrations.CreateModel(
+            name="PlayRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("hour", models.DateTimeField()),
+                ("plays", models.PositiveIntegerField(default=0)),
+                ("skips", models.PositiveIntegerField(default=0)),
+                ("last_played_at", models.DateTimeField(null=True)),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="tomato.asset",
+                    ),
+                ),
+                (
+                    "rotator",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="tomato.rotator",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "play rollup",
+                "db_table": "play_rollups",
+                "ordering": ("-hour",),
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("hour", "asset", "rotator", "user"), name="play_rollups_unique", nulls_distinct=False
+                    )
+                ],
+            },
+        ),
+    ]
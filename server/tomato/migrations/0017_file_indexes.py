@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:00
+
+from django.db import migrations, models
+import tomato.models.asset
+import tomato.models.base
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tomato", "0016_play_rollups"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="asset",
+            name="file",
+            field=tomato.models.base.AudioFileField(
+                db_index=True, max_length=120, upload_to=tomato.models.asset.asset_upload_to, verbose_name="audio file"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="assetalternate",
+            name="file",
+            field=tomato.models.base.AudioFileField(
+                db_index=True, max_length=120, upload_to=tomato.models.asset.asset_upload_to, verbose_name="audio file"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="savedassetfile",
+            name="file",
+            field=models.FileField(db_index=True, max_length=120, upload_to=""),
+        ),
+    ]
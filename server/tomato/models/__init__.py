@@ -1,4 +1,4 @@
-from .asset import Asset, AssetAlternate, SavedAssetFile
+from .asset import Asset, AssetAlternate, AssetFingerprint, SavedAssetFile
 from .base import NAME_MAX_LENGTH
 from .client_log_entry import ClientLogEntry
 from .import_export import (
@@ -7,8 +7,9 @@ from .import_export import (
     export_data_as_zip,
     import_data_from_zip,
 )
+from .play_rollup import PlayRollup
 from .rotator import Rotator
-from .serialize import serialize_for_api, serialize_for_api_sync
+from .serialize import serialize_changes_for_api, serialize_for_api, serialize_for_api_sync
 from .stopset import Stopset, StopsetRotator
 from .user import User
 
@@ -16,14 +17,17 @@ from .user import User
 __all__ = (
     Asset,
     AssetAlternate,
+    AssetFingerprint,
     ClientLogEntry,
     export_data_as_zip,
     ImportTomatoDataException,
     import_data_from_zip,
     NAME_MAX_LENGTH,
+    PlayRollup,
     REQUIRED_EMPTY_FOR_IMPORT_MODEL_CLASSES,
     Rotator,
     SavedAssetFile,
+    serialize_changes_for_api,
     serialize_for_api,
     serialize_for_api_sync,
     Stopset,
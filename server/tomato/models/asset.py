@@ -1,14 +1,16 @@
 import datetime
-import hashlib
 import itertools
 import logging
+import os
 from pathlib import Path
 import random
 import string
+import time
 
 from django.apps import apps
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Count, OuterRef, Subquery
 from django.db.models.functions import Coalesce
@@ -17,7 +19,8 @@ from django.utils.html import format_html, format_html_join
 
 from constance import config
 
-from ..utils import listdir_recursive
+from ..ffmpeg import md5sum_file
+from ..utils import scandir_recursive
 from .base import (
     FILE_MAX_LENGTH,
     NAME_MAX_LENGTH,
@@ -30,6 +33,11 @@ from .rotator import Rotator
 
 
 logger = logging.getLogger(__name__)
+MEDIA_CLEANUP_CHUNK_SIZE = 1000  # Files on disk checked against the DB per query
+MEDIA_CLEANUP_CURSOR_CACHE_KEY = "media-cleanup:cursor"
+# Files newer than this may belong to an upload, processing task or import that hasn't been recorded yet
+MEDIA_CLEANUP_GRACE_PERIOD = datetime.timedelta(hours=6)
+CONTENT_ADDRESSED_DIR = "content"  # Served with immutable cache headers by nginx
 
 
 class AssetEligibleToAirQuerySet(EligibleToAirQuerySet):
@@ -37,9 +45,19 @@ class AssetEligibleToAirQuerySet(EligibleToAirQuerySet):
         return models.Q(status=Asset.Status.READY) & super()._get_currently_airing_Q(now)
 
 
+def shard_asset_filename(filename):
+    # Spread files over nested directories (ie ab/cd/abcd...) so no one directory holds the whole library
+    name = Path(filename).name
+    return f"{name[0:2].lower()}/{name[2:4].lower()}/{name}"
+
+
 def generate_random_asset_filename(original_filename):
     stem = "".join(random.choice(string.ascii_letters + string.digits) for _ in range(32))
-    return f"{stem}{Path(original_filename).suffix}"
+    return shard_asset_filename(f"{stem}{Path(original_filename).suffix}")
+
+
+def content_addressed_asset_filename(md5sum, suffix):
+    return f"{CONTENT_ADDRESSED_DIR}/{shard_asset_filename(f'{md5sum.hex()}{suffix}')}"
 
 
 def asset_upload_to(instance, filename):
@@ -48,12 +66,14 @@ def asset_upload_to(instance, filename):
 
 
 class AssetBase(TomatoModelBase):
+    FINGERPRINT_FIELD = None  # Field on AssetFingerprint pointing to this model
+
     class Status(models.IntegerChoices):
         PENDING = 0, "Pending processing"
         PROCESSING = 1, "Processing"
         READY = 2, "Ready"
 
-    file = AudioFileField("audio file", upload_to=asset_upload_to)
+    file = AudioFileField("audio file", upload_to=asset_upload_to, db_index=True)
     # Original filename WITHOUT a suffix (stem only)
     original_filename = models.CharField(max_length=FILE_MAX_LENGTH)
     pre_process_md5sum = models.BinaryField(max_length=16, null=True, default=None)
@@ -64,6 +84,8 @@ class AssetBase(TomatoModelBase):
     )
     duration = models.DurationField(default=datetime.timedelta(0))
     comment = models.TextField(help_text="Any private comments about a particular asset", blank=True)
+    # For incremental exports
+    updated_at = models.DateTimeField("updated at", auto_now=True, db_index=True)
 
     SERIALIZE_FIELDS_TO_IGNORE = {
         "pre_process_md5sum",
@@ -71,6 +93,7 @@ class AssetBase(TomatoModelBase):
         "status",
         "file",
         "duration",
+        "updated_at",
     } | TomatoModelBase.SERIALIZE_FIELDS_TO_IGNORE
 
     class Meta:
@@ -89,22 +112,26 @@ class AssetBase(TomatoModelBase):
         super().full_clean(*args, **kwargs)
         if self.file and (force_check_against_md5sum is not None or "file" in self.get_dirty_fields()):
             if config.PREVENT_DUPLICATE_ASSETS:
-                md5sum = force_check_against_md5sum or self.generate_md5sum()
-                querysets = {
-                    Asset: Asset.objects.filter(pre_process_md5sum=md5sum),
-                    AssetAlternate: AssetAlternate.objects.filter(pre_process_md5sum=md5sum),
-                }
+                md5sum = force_check_against_md5sum
+                if md5sum is None:
+                    # Computed by AudioFileField.validate() during super().full_clean(), unless file was excluded
+                    analysis = getattr(self.file, "analysis", None)
+                    md5sum = analysis.md5sum if analysis else self.generate_md5sum()
+                # One indexed lookup covering both assets and alternates
+                fingerprints = AssetFingerprint.objects.filter(md5sum=md5sum).select_related(
+                    "asset", "alternate__asset"
+                )
                 if self.id is not None:
-                    querysets[self._meta.model] = querysets[self._meta.model].exclude(id=self.id)
+                    fingerprints = fingerprints.exclude(**{self.FINGERPRINT_FIELD: self.id})
 
                 duplicates = []
-                for queryset in querysets.values():
-                    for duplicate in queryset:
-                        meta = duplicate._meta
-                        duplicates.append((
-                            reverse(f"admin:{meta.app_label}_{meta.model_name}_change", args=(duplicate.id,)),
-                            duplicate.name,
-                        ))
+                for fingerprint in fingerprints:
+                    duplicate = fingerprint.asset or fingerprint.alternate
+                    meta = duplicate._meta
+                    duplicates.append((
+                        reverse(f"admin:{meta.app_label}_{meta.model_name}_change", args=(duplicate.id,)),
+                        duplicate.name,
+                    ))
                 if duplicates:
                     duplicates_html = format_html_join(", ", '<a href="{}">{}</a>', duplicates)
                     raise ValidationError({
@@ -120,19 +147,43 @@ class AssetBase(TomatoModelBase):
         pass
 
     def save(self, dont_overwrite_original_filename=False, *args, **kwargs):
-        if not dont_overwrite_original_filename and "file" in self.get_dirty_fields():
+        dirty_fields = self.get_dirty_fields()
+        if not dont_overwrite_original_filename and "file" in dirty_fields:
             self.original_filename = Path(self.file.name).with_suffix("").name
         self.pre_save_normalize_hook()  # Way to clean up `self.name`
         super().save(*args, **kwargs)
+        if "pre_process_md5sum" in dirty_fields:
+            self.update_fingerprint()
+
+    def update_fingerprint(self):
+        if self.pre_process_md5sum is None:
+            AssetFingerprint.objects.filter(**{self.FINGERPRINT_FIELD: self}).delete()
+        else:
+            AssetFingerprint.objects.update_or_create(
+                **{self.FINGERPRINT_FIELD: self}, defaults={"md5sum": bytes(self.pre_process_md5sum)}
+            )
 
-    def generate_md5sum(self):
-        md5sum = hashlib.md5()
-
-        with open(self.file.real_path, "rb") as file:
-            while chunk := file.read(1024 * 128):
-                md5sum.update(chunk)
+    def store_content_addressed(self):
+        """Move our processed file to a name derived from its md5sum, sharing it if identical audio is already stored"""
+        name = content_addressed_asset_filename(self.md5sum, Path(self.file.name).suffix)
+        if self.file.name == name:
+            return
+
+        old_path = Path(self.file.path)
+        new_path = Path(settings.MEDIA_ROOT) / name
+        new_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Hard link rather than rename, so we never clobber a copy another asset already uses
+            os.link(old_path, new_path)
+        except FileExistsError:
+            logger.info(f"Sharing content-addressed file {name} for {self}")
+        # Files are shared by any number of assets and alternates, then cleaned up once no rows refer to them
+        if not SavedAssetFile.objects.filter(file=self.file.name).exists():
+            old_path.unlink()
+        self.file.name = name
 
-        return md5sum.digest()
+    def generate_md5sum(self):
+        return md5sum_file(self.file.real_path)
 
     @property
     def filename(self):
@@ -141,6 +192,7 @@ class AssetBase(TomatoModelBase):
 
 class Asset(EnabledBeginEndWeightMixin, AssetBase):
     objects = AssetEligibleToAirQuerySet.as_manager()
+    API_ENTITY_TYPE = "assets"
 
     name = models.CharField(
         "name",
@@ -169,6 +221,7 @@ class Asset(EnabledBeginEndWeightMixin, AssetBase):
         default=False,
         help_text="Archived models will not show in the desktop client. Think of archive as 'soft delete'.",
     )
+    FINGERPRINT_FIELD = "asset"
 
     class Meta(TomatoModelBase.Meta):
         db_table = "assets"
@@ -227,6 +280,9 @@ Asset.rotators.through._meta.verbose_name_plural = "Asset in rotator relationshi
 
 class AssetAlternate(AssetBase):
     _num_before = None
+    API_ENTITY_TYPE = "assets"
+    API_ENTITY_ID_FIELD = "asset_id"
+    FINGERPRINT_FIELD = "alternate"
     asset = models.ForeignKey(
         Asset, on_delete=models.CASCADE, related_name="alternates", verbose_name="alternate for asset"
     )
@@ -272,8 +328,28 @@ for model_class in (Asset, AssetAlternate):
 del model_class
 
 
+class AssetFingerprint(models.Model):
+    # Content fingerprints of both assets and alternates (as uploaded), for finding duplicates
+    md5sum = models.BinaryField(max_length=16, db_index=True)
+    asset = models.OneToOneField(Asset, null=True, on_delete=models.CASCADE, related_name="fingerprint")
+    alternate = models.OneToOneField(AssetAlternate, null=True, on_delete=models.CASCADE, related_name="fingerprint")
+
+    class Meta:
+        db_table = "asset_fingerprints"
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(asset__isnull=False, alternate__isnull=True)
+                | models.Q(asset__isnull=True, alternate__isnull=False),
+                name="asset_fingerprint_asset_xor_alternate",
+            )
+        ]
+
+    def __str__(self):
+        return f"Fingerprint {self.md5sum.hex()} for {self.asset or self.alternate}"
+
+
 class SavedAssetFile(models.Model):
-    file = models.FileField(max_length=FILE_MAX_LENGTH)
+    file = models.FileField(max_length=FILE_MAX_LENGTH, db_index=True)
     original_filename = models.CharField(max_length=FILE_MAX_LENGTH)
 
     @property
@@ -281,64 +357,81 @@ class SavedAssetFile(models.Model):
         return f"{self.original_filename}{Path(self.file.name).suffix}"
 
     @classmethod
-    def cleanup_unreferenced_files(cls):
-        model_file_fields = []
-
-        # Cleanup untracked files below
-
-        # Figure out what models have file fields
-        for model_cls in apps.get_models():
-            if model_cls is not cls:
-                model_fields = model_cls._meta.get_fields()
-                for field in model_fields:
-                    if isinstance(field, models.FileField):
-                        model_file_fields.append((model_cls, field.name))
-
-        # Build our sets of files in the DB
-        recorded_db_files = set(cls.objects.values_list("file", flat=True))
-        all_db_files = (
-            set(
-                itertools.chain.from_iterable(
-                    model_cls.objects.values_list(file_field, flat=True) for model_cls, file_field in model_file_fields
-                )
+    def track_unrecorded_files(cls):
+        # Track missing SavedAssetFiles (potentially unrecorded because of older version of tomato)
+        unrecorded = {}
+        for model_cls in (Asset, AssetAlternate):
+            unrecorded.update(
+                model_cls.objects.exclude(file="")
+                .exclude(file__in=cls.objects.values("file"))
+                .values_list("file", "original_filename")
             )
-            | recorded_db_files
+        cls.objects.bulk_create(
+            cls(file=file, original_filename=original_filename) for file, original_filename in unrecorded.items()
         )
-        db_files_that_should_be_recorded = (
-            set(
+        if unrecorded:
+            logger.warning(f"Now tracking {len(unrecorded)} files that should have been tracked")
+
+    @classmethod
+    def cleanup_unreferenced_files(cls, *, dry_run=False, max_files=None, restart=False):
+        """Incrementally delete files in MEDIA_ROOT no file field refers to, resuming after the last pass's cursor"""
+        if not dry_run:
+            cls.track_unrecorded_files()
+
+        model_file_fields = [
+            (model_cls, field.name)
+            for model_cls in apps.get_models()
+            for field in model_cls._meta.get_fields()
+            if isinstance(field, models.FileField)
+        ]
+        media_root = Path(settings.MEDIA_ROOT)
+        cursor = None if restart else cache.get(MEDIA_CLEANUP_CURSOR_CACHE_KEY)
+        grace_cutoff = time.time() - MEDIA_CLEANUP_GRACE_PERIOD.total_seconds()
+        report = {"resumed_after": cursor, "scanned": 0, "in_grace_period": 0, "unreferenced": [], "bytes": 0}
+
+        files = scandir_recursive(media_root, after=cursor, skip_dirs=(settings.FILE_FORM_UPLOAD_DIR,))
+        while chunk := list(itertools.islice(files, MEDIA_CLEANUP_CHUNK_SIZE)):
+            paths = [path for path, _ in chunk]
+            # One indexed lookup per file field for the whole chunk
+            referenced = set(
                 itertools.chain.from_iterable(
-                    model_cls.objects.values_list("file", flat=True) for model_cls in (Asset, AssetAlternate)
+                    model_cls.objects.filter(**{f"{field}__in": paths}).values_list(field, flat=True)
+                    for model_cls, field in model_file_fields
                 )
             )
-            - recorded_db_files
-        )
-
-        # Create missing SavedAssetFiles (potentially unrecorded because of older version of tomato)
-        for file in db_files_that_should_be_recorded:
-            for model_cls, file_field in model_file_fields:
+            for path, entry in chunk:
+                if path in referenced:
+                    continue
                 try:
-                    obj = model_cls.objects.get(**{file_field: file})
-                except ObjectDoesNotExist:
-                    pass
-                else:
-                    break
-            else:
-                raise Exception("Should not have gotten here!")
-
-            cls.objects.create(file=obj.file, original_filename=obj.original_filename)
-
-        if db_files_that_should_be_recorded:
-            logger.warning(f"Now tracking {len(db_files_that_should_be_recorded)} files that should have been tracked")
-
-        all_files_on_disk = set(listdir_recursive(settings.MEDIA_ROOT))
-
-        logger.info(f"Tracking {len(all_db_files)} files, found {len(all_files_on_disk)} files on disk")
-        files_to_be_deleted = all_files_on_disk - all_db_files
-        media_root = Path(settings.MEDIA_ROOT)
-        for file_to_be_deleted in files_to_be_deleted:
-            file = media_root / file_to_be_deleted
-            file.unlink()
-        logger.info(f"Deleted {len(files_to_be_deleted)} untracked files")
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime > grace_cutoff:
+                        report["in_grace_period"] += 1
+                        continue
+                    if not dry_run:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue  # Deleted from under us
+                report["unreferenced"].append(path)
+                report["bytes"] += stat.st_size
+
+            report["scanned"] += len(chunk)
+            cursor = paths[-1]
+            if not dry_run:
+                cache.set(MEDIA_CLEANUP_CURSOR_CACHE_KEY, cursor, timeout=None)
+            if max_files is not None and report["scanned"] >= max_files:
+                break
+        else:
+            cursor = None  # Finished a full pass, next one starts from the beginning
+            if not dry_run:
+                cache.delete(MEDIA_CLEANUP_CURSOR_CACHE_KEY)
+
+        report["next_cursor"] = cursor
+        logger.info(
+            f"{'Would have deleted' if dry_run else 'Deleted'} {len(report['unreferenced'])} untracked files"
+            f" ({report['bytes']} bytes) out of {report['scanned']} scanned,"
+            f" {'finished pass' if cursor is None else f'resuming after {cursor} next time'}"
+        )
+        return report
 
     def __str__(self):
         return self.filename
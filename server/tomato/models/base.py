@@ -1,4 +1,5 @@
 import logging
+import math
 from pathlib import Path
 import zoneinfo
 
@@ -14,8 +15,8 @@ from dirtyfields import DirtyFieldsMixin
 from django_file_form.uploaded_file import UploadedTusFile
 
 from ..constants import HELP_DOCS_URL
-from ..ffmpeg import ffprobe, silence_detect
-from ..utils import notify_api
+from ..ffmpeg import analyze_audio
+from ..utils import notify_api_db_change
 
 
 NAME_MAX_LENGTH = 120
@@ -48,43 +49,79 @@ class AudioFileField(models.FileField):
     def validate(self, value, model_instance):
         super().validate(value, model_instance)
 
-        if not ffprobe(value.real_path):
+        # Only decode for silences if we're rejecting them. Kept so full_clean() needn't hash the file again.
+        analysis = value.analysis = analyze_audio(value.real_path, decode=config.REJECT_SILENCE_LENGTH > 0)
+        if not analysis:
             raise ValidationError("No audio detected in this file. Try again with another file.")
 
-        if config.REJECT_SILENCE_LENGTH > 0:
-            has_silence, silence_duration = silence_detect(value.real_path)
-            if has_silence:
-                raise ValidationError(
-                    f"This asset contains a silence of {silence_duration} seconds. Audio must contain less than"
-                    f" {config.REJECT_SILENCE_LENGTH} seconds of silence."
-                )
+        if config.REJECT_SILENCE_LENGTH > 0 and analysis.longest_silence >= config.REJECT_SILENCE_LENGTH:
+            raise ValidationError(
+                f"This asset contains a silence of {math.ceil(analysis.longest_silence)} seconds. Audio must contain"
+                f" less than {config.REJECT_SILENCE_LENGTH} seconds of silence."
+            )
 
 
 class DBNotifyBase(DirtyFieldsMixin):
+    # Which entity type in serialize_for_api() a change to this model affects, and the field holding its id
+    API_ENTITY_TYPE = None
+    API_ENTITY_ID_FIELD = "id"
+    # Deleting some models cascades to other entities' relations, so the API needs to re-serialize everything
+    API_FULL_REFRESH_ON_DELETE = False
+
+    def get_api_changes(self, dirty_fields=None):
+        if self.API_ENTITY_TYPE is None:
+            return None
+        ids = {getattr(self, self.API_ENTITY_ID_FIELD)}
+        if dirty_fields and self.API_ENTITY_ID_FIELD != "id":
+            # Entity this object previously belonged to changed too
+            old_id = dirty_fields.get(self.API_ENTITY_ID_FIELD.removesuffix("_id"))
+            if old_id is not None:
+                ids.add(old_id)
+        return {self.API_ENTITY_TYPE: sorted(id for id in ids if id is not None)}
+
     def save(self, *args, **kwargs):
-        if self.is_dirty(check_relationship=True):
-            logger.debug(f"Model {self._meta.verbose_name} was saved, notifying API")
-            notify_api()
+        dirty_fields = self.get_dirty_fields(check_relationship=True)
         super().save(*args, **kwargs)
+        if dirty_fields:
+            logger.debug(f"Model {self._meta.verbose_name} was saved, notifying API")
+            notify_api_db_change(self.get_api_changes(dirty_fields))
 
     def delete(self, *args, **kwargs):
-        notify_api()
+        changes = None if self.API_FULL_REFRESH_ON_DELETE else self.get_api_changes()
+        deleted = super().delete(*args, **kwargs)
         logger.debug(f"Model {self._meta.verbose_name} was deleted, notifying API")
-        return super().delete(*args, **kwargs)
+        notify_api_db_change(changes)  # Published once the transaction (if any) commits
+        return deleted
 
 
 class TomatoModelBaseQueryset(models.QuerySet):
+    def get_api_changes(self, new_values=None):
+        entity_type, id_field = self.model.API_ENTITY_TYPE, self.model.API_ENTITY_ID_FIELD
+        if entity_type is None:
+            return None
+        ids = set(self.values_list(id_field, flat=True).distinct())
+        if new_values:
+            # Entity objects are being moved to changed too (ie, update(asset=...) on alternates)
+            new_value = new_values.get(id_field, new_values.get(id_field.removesuffix("_id")))
+            if new_value is not None:
+                ids.add(getattr(new_value, "pk", new_value))
+        return {entity_type: sorted(ids)}
+
     def update(self, **kwargs):
+        changes = self.get_api_changes(kwargs)  # Before updating, since the update may change which rows match
+        num_updated = super().update(**kwargs)
         logger.debug(f"Called update() on queryset for {self.model._meta.verbose_name}, notifying API")
-        notify_api()
-        return super().update(**kwargs)
+        notify_api_db_change(changes)
+        return num_updated
 
     update.alters_data = True
 
     def delete(self):
+        changes = None if self.model.API_FULL_REFRESH_ON_DELETE else self.get_api_changes()
+        deleted = super().delete()
         logger.debug(f"Called delete() on queryset for {self.model._meta.verbose_name}, notifying API")
-        notify_api()
-        return super().delete()
+        notify_api_db_change(changes)
+        return deleted
 
     delete.alters_data = True
     delete.queryset_only = True
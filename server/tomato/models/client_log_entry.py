@@ -1,12 +1,67 @@
 import uuid
+import zlib
 
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.utils import timezone
 
 from ..constants import CLIENT_LOG_ENTRY_TYPES
+from ..utils import django_json_dumps
 from .user import User
 
 
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = (
+    "id",
+    "created_at",
+    "type",
+    "created_by__username",
+    "ip_address",
+    "description",
+    "asset_id",
+    "rotator_id",
+    "stopset_id",
+)
+
+
+class ClientLogEntryQuerySet(models.QuerySet):
+    def created_between(self, start=None, end=None):
+        # Range scans on created_at are served by the BRIN index, since the table is (roughly) append-only
+        queryset = self
+        if start is not None:
+            queryset = queryset.filter(created_at__gte=start)
+        if end is not None:
+            queryset = queryset.filter(created_at__lt=end)
+        return queryset
+
+    def export_rows(self):
+        # Server-side cursor, without instantiating models
+        return self.order_by("created_at").values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def export_ndjson_gz(self):
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        lines = []
+        for id, created_at, type, username, ip_address, description, *ref_ids in self.export_rows():
+            entry = {
+                "id": id,
+                "created_at": created_at,
+                "category": self.model.CATEGORIES.get(type, "unspecified"),
+                "type": type,
+                "created_by": username,
+                "ip_address": ip_address,
+                "description": description,
+                **dict(zip(("asset_id", "rotator_id", "stopset_id"), ref_ids)),
+            }
+            lines.append(f"{django_json_dumps(entry)}\n")
+            if len(lines) >= EXPORT_CHUNK_SIZE:
+                if data := compressor.compress("".join(lines).encode()):
+                    yield data
+                lines = []
+        if lines:
+            yield compressor.compress("".join(lines).encode())
+        yield compressor.flush()
+
+
 class ClientLogEntry(models.Model):
     class Type(models.TextChoices):
         INTERNAL_ERROR = "internal_error", "Internal client error"
@@ -40,16 +95,26 @@ class ClientLogEntry(models.Model):
     if set(CATEGORIES.keys()) != CLIENT_LOG_ENTRY_TYPES:
         raise Exception("Log entry type without a category found")
 
+    objects = ClientLogEntryQuerySet.as_manager()
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     ip_address = models.GenericIPAddressField("IP address", null=True, blank=True)
-    created_at = models.DateTimeField(
-        default=timezone.now, db_index=True
-    )  # Dont use auto_now_add since client provides
+    created_at = models.DateTimeField(default=timezone.now)  # Dont use auto_now_add since client provides
     created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, blank=True)
     type = models.CharField(
         max_length=max(len(value) for value in Type.values), choices=Type.choices, default=Type.UNSPECIFIED
     )
     description = models.TextField(blank=True)
+    # Structured references for play events, which may outlive what they refer to
+    asset = models.ForeignKey(
+        "tomato.Asset", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", null=True, blank=True
+    )
+    rotator = models.ForeignKey(
+        "tomato.Rotator", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", null=True, blank=True
+    )
+    stopset = models.ForeignKey(
+        "tomato.Stopset", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", null=True, blank=True
+    )
 
     def __str__(self):
         return (
@@ -65,3 +130,8 @@ class ClientLogEntry(models.Model):
         verbose_name_plural = "client logs"
         db_table = "logs"
         ordering = ("-created_at", "-id")
+        indexes = (
+            BrinIndex(fields=("created_at",), name="logs_created_at_brin"),
+            # Matches ordering, so changelists and exports read rows in order rather than sorting the whole table
+            models.Index(fields=("created_at", "id"), name="logs_created_at_id"),
+        )
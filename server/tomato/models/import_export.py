@@ -1,26 +1,33 @@
+from contextlib import contextmanager
 import datetime
 import itertools
 import json
 import logging
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import shutil
-import tempfile
 import zipfile
 
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from django.utils import timezone
 
 from ..tasks import bulk_process_assets
+from ..utils import notify_api_db_change, stream_zip
 from .asset import Asset, AssetAlternate
 from .rotator import Rotator
 from .serialize import serialize_for_api_sync
 from .stopset import Stopset, StopsetRotator
 
 
-EXPORT_FORMAT = 1  # In case we break compatibility
+EXPORT_FORMAT = 2  # In case we break compatibility (2 added incremental exports)
+IMPORT_FORMATS = (1, 2)
 EXPORT_FOLDER_NAME_PREFIX = "tomato-export-data"
 REQUIRED_EMPTY_FOR_IMPORT_MODEL_CLASSES = (Asset, AssetAlternate, Rotator, Stopset, StopsetRotator)
+IMPORT_BATCH_SIZE = 500
+IMPORT_COPY_CHUNK_SIZE = 1024 * 256
+# Fields describing an existing asset's file (or creation) that a merge-import leaves alone
+MERGE_IMPORT_IGNORED_FIELDS = {"created_at", "file", "md5sum", "duration", "filesize", "original_filename"}
 logger = logging.getLogger(__name__)
 
 
@@ -28,10 +35,19 @@ class ImportTomatoDataException(Exception):
     pass
 
 
-def export_data_as_zip(file):
+def export_data_as_zip(since=None):
+    # Returns the archive's filename and a generator of its contents, so it can be streamed without a temporary file.
+    # With since, metadata is still complete but only files of assets updated since then are included (merge-import
+    # matches the rest by md5sum).
     export_folder_name = Path(f"{EXPORT_FOLDER_NAME_PREFIX}-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}")
-
-    zip = zipfile.ZipFile(file, "w")
+    if since is not None:
+        export_folder_name = export_folder_name.with_name(f"{export_folder_name.name}-incremental")
+        changed_files = set(
+            itertools.chain.from_iterable(
+                model_cls.objects.filter(updated_at__gte=since).values_list("file", flat=True)
+                for model_cls in (Asset, AssetAlternate)
+            )
+        )
 
     metadata = serialize_for_api_sync(skip_config=True, include_archived=True)
     # Remove IDs from all but rotators (only they are needed for import)
@@ -41,111 +57,290 @@ def export_data_as_zip(file):
             del alternate["id"], alternate["url"]
     for stopset in metadata["stopsets"]:
         del stopset["id"]
-    metadata["export_format"] = EXPORT_FORMAT
+    metadata.update({"export_format": EXPORT_FORMAT, "since": since})
 
-    zip.writestr(
-        str(export_folder_name / "metadata.json"),
-        f"{json.dumps(metadata, indent=2, sort_keys=True, cls=DjangoJSONEncoder)}\n",
-    )
+    def entries():
+        yield (
+            export_folder_name / "metadata.json",
+            f"{json.dumps(metadata, indent=2, sort_keys=True, cls=DjangoJSONEncoder)}\n".encode(),
+        )
 
-    media_root = Path(settings.MEDIA_ROOT)
+        media_root = Path(settings.MEDIA_ROOT)
 
-    for n, asset in enumerate(metadata["assets"], 1):
-        logger.info(f"Exporting {n}/{len(metadata['assets'])} assets...")
-        for file in itertools.chain((asset,), asset["alternates"]):
-            local_file_path = media_root / file["file"]
-            export_file_path = export_folder_name / "assets" / file["file"]
-            zip.write(str(local_file_path), str(export_file_path))
+        for n, asset in enumerate(metadata["assets"], 1):
+            logger.info(f"Exporting {n}/{len(metadata['assets'])} assets...")
+            for file in itertools.chain((asset,), asset["alternates"]):
+                if since is None or file["file"] in changed_files:
+                    yield (export_folder_name / "assets" / file["file"], media_root / file["file"])
 
-    zip.close()
-    logger.info("Export done!")
-    return f"{export_folder_name}.zip"
+        logger.info("Export done!")
 
+    return f"{export_folder_name}.zip", stream_zip(entries())
 
-def import_data_from_zip(file, created_by=None):
-    for model_cls in REQUIRED_EMPTY_FOR_IMPORT_MODEL_CLASSES:
-        if model_cls.objects.exists():
-            raise ImportTomatoDataException(f"can't import data when {model_cls._meta.verbose_name_plural} exist!")
 
+def extract_zip_member(zip_file, name, destination_path):
+    # Stream straight to the final location, under a temporary name so a partial file is never picked up
+    destination_path.parent.mkdir(parents=True, exist_ok=True)  # Make sure parent dir exists
+    partial_path = destination_path.with_name(f".{destination_path.name}.importing")
+    with zip_file.open(name) as src, open(partial_path, "wb") as dest:
+        shutil.copyfileobj(src, dest, IMPORT_COPY_CHUNK_SIZE)
+    partial_path.rename(destination_path)
+
+
+def open_export_zip(file):
     try:
-        zip = zipfile.ZipFile(file)
+        zip_file = zipfile.ZipFile(file)
     except zipfile.BadZipFile:
         raise ImportTomatoDataException("bad archive format!")
 
-    stats = {"rotators": 0, "assets": 0, "stopsets": 0}
+    names = zip_file.namelist()
+    folder_names = {PurePosixPath(name).parts[0] for name in names}
+    if len(folder_names) != 1 or any("/" not in name for name in names):
+        raise ImportTomatoDataException("needs exactly one folder!")
 
-    with tempfile.TemporaryDirectory(delete=True) as temp_dir:
-        temp_dir = Path(temp_dir)
-        zip.extractall(str(temp_dir))
+    folder = PurePosixPath(folder_names.pop())
+    try:
+        with zip_file.open(str(folder / "metadata.json"), "r") as file:
+            metadata = json.load(file)
+    except KeyError:
+        raise ImportTomatoDataException("no metadata file!")
 
-        temp_dir_contents = list(temp_dir.iterdir())
-        if len(temp_dir_contents) != 1 or not temp_dir_contents[0].is_dir():
-            raise ImportTomatoDataException("needs exactly one folder!")
+    if metadata["export_format"] not in IMPORT_FORMATS:
+        raise ImportTomatoDataException("Invalid format version!")
 
-        temp_dir = temp_dir_contents[0]
-        metadata_file = temp_dir / "metadata.json"
-        assets_prefix = temp_dir / "assets"
-        media_root = Path(settings.MEDIA_ROOT)
+    return zip_file, folder / "assets", metadata
 
-        if not metadata_file.exists():
-            raise ImportTomatoDataException("no metadata file!")
 
-        with open(metadata_file, "r") as file:
-            metadata = json.load(file)
+@contextmanager
+def remove_extracted_files_on_error():
+    # Files are extracted straight into MEDIA_ROOT, so they'd be orphaned if the import's transaction rolls back
+    extracted_paths = []
+    try:
+        yield extracted_paths
+    except BaseException:
+        logger.warning(f"Import failed, removing {len(extracted_paths)} extracted files")
+        for path in extracted_paths:
+            path.unlink(missing_ok=True)
+        raise
+
+
+def import_asset_file(zip_file, assets_prefix, file, extracted_paths):
+    # Extracts an asset's (or alternate's) file and converts its metadata to model field values
+    destination_path = Path(settings.MEDIA_ROOT) / file["file"]
+    if not destination_path.exists():  # Never remove a file that was already there
+        extracted_paths.append(destination_path)
+    extract_zip_member(zip_file, str(assets_prefix / file["file"]), destination_path)
+    file.update({
+        "md5sum": bytes.fromhex(file["md5sum"]),
+        "duration": datetime.timedelta(seconds=file["duration"]),
+    })
+
+
+def import_data_from_zip(file, created_by=None, merge=False):
+    if merge:
+        return merge_import_data_from_zip(file, created_by=created_by)
+
+    for model_cls in REQUIRED_EMPTY_FOR_IMPORT_MODEL_CLASSES:
+        if model_cls.objects.exists():
+            raise ImportTomatoDataException(f"can't import data when {model_cls._meta.verbose_name_plural} exist!")
 
-        if metadata["export_format"] != EXPORT_FORMAT:
-            raise ImportTomatoDataException("Invalid format version!")
+    zip_file, assets_prefix, metadata = open_export_zip(file)
+    if metadata.get("since") is not None:
+        raise ImportTomatoDataException("incremental exports can only be merged into existing data!")
 
-        rotator_id_to_obj = {}
-        for kwargs in metadata["rotators"]:
-            rotator_id = kwargs.pop("id")
-            rotator_id_to_obj[rotator_id] = Rotator.objects.create(created_by=created_by, **kwargs)
-            stats["rotators"] += 1
+    stats = {"rotators": 0, "assets": 0, "stopsets": 0}
+
+    with remove_extracted_files_on_error() as extracted_paths, transaction.atomic():
+        rotator_ids = [kwargs.pop("id") for kwargs in metadata["rotators"]]
+        rotators = Rotator.objects.bulk_create(
+            [Rotator(created_by=created_by, **kwargs) for kwargs in metadata["rotators"]],
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+        rotator_id_to_obj = dict(zip(rotator_ids, rotators))
+        stats["rotators"] = len(rotators)
 
         logger.info(f"Imported {stats['rotators']} rotators.")
 
-        for kwargs in metadata["stopsets"]:
-            rotators = [rotator_id_to_obj[rotator_id] for rotator_id in kwargs.pop("rotators")]
-            stopset = Stopset.objects.create(created_by=created_by, **kwargs)
-            for rotator in rotators:
-                StopsetRotator.objects.create(stopset=stopset, rotator=rotator)
-            stats["stopsets"] += 1
+        stopset_rotator_ids = [kwargs.pop("rotators") for kwargs in metadata["stopsets"]]
+        stopsets = Stopset.objects.bulk_create(
+            [Stopset(created_by=created_by, **kwargs) for kwargs in metadata["stopsets"]],
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+        StopsetRotator.objects.bulk_create(
+            [
+                StopsetRotator(stopset=stopset, rotator=rotator_id_to_obj[rotator_id])
+                for stopset, rotator_ids in zip(stopsets, stopset_rotator_ids)
+                for rotator_id in rotator_ids
+            ],
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+        stats["stopsets"] = len(stopsets)
 
         logger.info(f"Imported {stats['stopsets']} stop sets.")
 
-        assets_to_process = []
-        for kwargs in metadata["assets"]:
+        assets, asset_rotator_ids, asset_alternates_kwargs = [], [], []
+        for n, kwargs in enumerate(metadata["assets"], 1):
+            logger.info(f"Importing files for {n}/{len(metadata['assets'])} assets...")
             for file in itertools.chain((kwargs,), kwargs["alternates"]):
-                destination_path = media_root / file["file"]
-                destination_path.parent.mkdir(parents=True, exist_ok=True)  # Make sure parent dir exists
-                shutil.move(assets_prefix / file["file"], destination_path)
-                logger.info(f"Copying file for import: {file['file']}")
-
-            kwargs.update({
-                "md5sum": bytes.fromhex(kwargs["md5sum"]),
-                "duration": datetime.timedelta(seconds=kwargs["duration"]),
-            })
-            alternates = kwargs.pop("alternates")
-            rotators = [rotator_id_to_obj[rotator_id] for rotator_id in kwargs.pop("rotators")]
+                import_asset_file(zip_file, assets_prefix, file, extracted_paths)
+
+            asset_alternates_kwargs.append(kwargs.pop("alternates"))
+            asset_rotator_ids.append(kwargs.pop("rotators"))
             asset = Asset(created_by=created_by, **kwargs)
             asset.clean()
-            asset.save(dont_overwrite_original_filename=True)
-            asset.rotators.add(*rotators)
-            assets_to_process.append(asset)
-            stats["assets"] += 1
-
-            if alternates:
-                for alternate_kwargs in alternates:
-                    alternate_kwargs.update({
-                        "md5sum": bytes.fromhex(alternate_kwargs["md5sum"]),
-                        "duration": datetime.timedelta(seconds=alternate_kwargs["duration"]),
-                    })
-                    alternate = AssetAlternate(created_by=created_by, asset=asset, **alternate_kwargs)
-                    alternate.clean()
-                    alternate.save(dont_overwrite_original_filename=True)
-                    assets_to_process.append(alternate)
-                    stats["assets"] += 1
-
-        bulk_process_assets(assets_to_process, user=created_by, from_command_line_import=True)
-
-        return stats
+            asset.pre_save_normalize_hook()  # Since bulk_create() doesn't call save()
+            assets.append(asset)
+
+        Asset.objects.bulk_create(assets, batch_size=IMPORT_BATCH_SIZE)
+        bulk_create_asset_rotators(assets, asset_rotator_ids, rotator_id_to_obj)
+
+        alternates = []
+        for asset, alternates_kwargs in zip(assets, asset_alternates_kwargs):
+            for alternate_kwargs in alternates_kwargs:
+                alternate = AssetAlternate(created_by=created_by, asset=asset, **alternate_kwargs)
+                alternate.clean()
+                alternates.append(alternate)
+        AssetAlternate.objects.bulk_create(alternates, batch_size=IMPORT_BATCH_SIZE)
+        stats["assets"] = len(assets) + len(alternates)
+
+        logger.info(f"Imported {stats['assets']} assets.")
+
+    # bulk_create() doesn't notify, so do it once here
+    notify_api_db_change()
+    bulk_process_assets(assets + alternates, user=created_by, from_command_line_import=True)
+
+    return stats
+
+
+def bulk_create_asset_rotators(assets, asset_rotator_ids, rotator_id_to_obj):
+    Asset.rotators.through.objects.bulk_create(
+        [
+            Asset.rotators.through(asset=asset, rotator=rotator_id_to_obj[rotator_id])
+            for asset, rotator_ids in zip(assets, asset_rotator_ids)
+            for rotator_id in rotator_ids
+        ],
+        batch_size=IMPORT_BATCH_SIZE,
+    )
+
+
+def get_merge_import_update_fields():
+    # Exported fields (see AssetBase.serialize()) a merge-import can change on an existing asset
+    return [
+        field.name
+        for field in Asset._meta.concrete_fields
+        if not field.primary_key
+        and not field.is_relation
+        and field.name not in Asset.SERIALIZE_FIELDS_TO_IGNORE | MERGE_IMPORT_IGNORED_FIELDS
+    ] + ["updated_at"]
+
+
+def merge_import_data_from_zip(file, created_by=None):
+    # Upserts rotators and stop sets by name and assets by md5sum, only extracting files that aren't already here
+    zip_file, assets_prefix, metadata = open_export_zip(file)
+    archive_names = set(zip_file.namelist())
+    stats = {"new rotators": 0, "new stopsets": 0, "new assets": 0, "updated assets": 0, "skipped assets": 0}
+
+    with remove_extracted_files_on_error() as extracted_paths, transaction.atomic():
+        rotator_id_to_obj = {}
+        for kwargs in metadata["rotators"]:
+            rotator_id, name = kwargs.pop("id"), kwargs.pop("name")
+            rotator_id_to_obj[rotator_id], created = Rotator.objects.update_or_create(
+                name=name,
+                defaults={k: v for k, v in kwargs.items() if k not in MERGE_IMPORT_IGNORED_FIELDS},
+                create_defaults={"created_by": created_by, **kwargs},
+            )
+            stats["new rotators"] += created
+
+        for kwargs in metadata["stopsets"]:
+            rotator_ids, name = kwargs.pop("rotators"), kwargs.pop("name")
+            stopset, created = Stopset.objects.update_or_create(
+                name=name,
+                defaults={k: v for k, v in kwargs.items() if k not in MERGE_IMPORT_IGNORED_FIELDS},
+                create_defaults={"created_by": created_by, **kwargs},
+            )
+            StopsetRotator.objects.filter(stopset=stopset).delete()
+            StopsetRotator.objects.bulk_create([
+                StopsetRotator(stopset=stopset, rotator=rotator_id_to_obj[rotator_id]) for rotator_id in rotator_ids
+            ])
+            stats["new stopsets"] += created
+
+        logger.info(f"Merged {len(metadata['rotators'])} rotators and {len(metadata['stopsets'])} stop sets.")
+
+        md5sums = [
+            bytes.fromhex(file["md5sum"])
+            for kwargs in metadata["assets"]
+            for file in itertools.chain((kwargs,), kwargs["alternates"])
+        ]
+        existing_assets = {bytes(asset.md5sum): asset for asset in Asset.objects.filter(md5sum__in=md5sums)}
+        existing_alternate_md5sums = {
+            (asset_id, bytes(md5sum))
+            for asset_id, md5sum in AssetAlternate.objects.filter(md5sum__in=md5sums).values_list("asset_id", "md5sum")
+        }
+
+        def has_file(file):
+            return str(assets_prefix / file["file"]) in archive_names
+
+        new_assets, new_asset_rotator_ids, new_asset_alternates_kwargs = [], [], []
+        updated_assets, updated_asset_rotator_ids, updated_asset_alternates_kwargs = [], [], []
+        for n, kwargs in enumerate(metadata["assets"], 1):
+            logger.info(f"Merging {n}/{len(metadata['assets'])} assets...")
+            alternates_kwargs, rotator_ids = kwargs.pop("alternates"), kwargs.pop("rotators")
+            asset = existing_assets.get(bytes.fromhex(kwargs["md5sum"]))
+
+            if asset is not None:
+                for field, value in kwargs.items():
+                    if field not in MERGE_IMPORT_IGNORED_FIELDS:
+                        setattr(asset, field, value)
+                asset.clean()
+                asset.pre_save_normalize_hook()
+                updated_assets.append(asset)
+                updated_asset_rotator_ids.append(rotator_ids)
+                updated_asset_alternates_kwargs.append(alternates_kwargs)
+            elif has_file(kwargs):
+                import_asset_file(zip_file, assets_prefix, kwargs, extracted_paths)
+                asset = Asset(created_by=created_by, **kwargs)
+                asset.clean()
+                asset.pre_save_normalize_hook()
+                new_assets.append(asset)
+                new_asset_rotator_ids.append(rotator_ids)
+                new_asset_alternates_kwargs.append(alternates_kwargs)
+            else:
+                logger.warning(f"Skipping asset {kwargs['name']}, its file isn't in archive or already imported")
+                stats["skipped assets"] += 1
+
+        if updated_assets:
+            now = timezone.now()
+            for asset in updated_assets:
+                asset.updated_at = now  # bulk_update() skips auto_now
+            Asset.objects.bulk_update(updated_assets, get_merge_import_update_fields(), batch_size=IMPORT_BATCH_SIZE)
+            Asset.rotators.through.objects.filter(asset__in=updated_assets).delete()
+        Asset.objects.bulk_create(new_assets, batch_size=IMPORT_BATCH_SIZE)
+        bulk_create_asset_rotators(
+            updated_assets + new_assets, updated_asset_rotator_ids + new_asset_rotator_ids, rotator_id_to_obj
+        )
+        stats["new assets"], stats["updated assets"] = len(new_assets), len(updated_assets)
+
+        new_alternates = []
+        for asset, alternates_kwargs in zip(
+            updated_assets + new_assets, updated_asset_alternates_kwargs + new_asset_alternates_kwargs
+        ):
+            for alternate_kwargs in alternates_kwargs:
+                if (asset.id, bytes.fromhex(alternate_kwargs["md5sum"])) in existing_alternate_md5sums:
+                    continue
+                if not has_file(alternate_kwargs):
+                    logger.warning(f"Skipping alternate for {asset.name}, its file isn't in archive")
+                    stats["skipped assets"] += 1
+                    continue
+                import_asset_file(zip_file, assets_prefix, alternate_kwargs, extracted_paths)
+                alternate = AssetAlternate(created_by=created_by, asset=asset, **alternate_kwargs)
+                alternate.clean()
+                new_alternates.append(alternate)
+        AssetAlternate.objects.bulk_create(new_alternates, batch_size=IMPORT_BATCH_SIZE)
+        stats["new assets"] += len(new_alternates)
+
+        logger.info(f"Merged assets: {stats}")
+
+    notify_api_db_change()
+    bulk_process_assets(new_assets + new_alternates, user=created_by, from_command_line_import=True)
+
+    return stats
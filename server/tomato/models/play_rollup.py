@@ -0,0 +1,87 @@
+from collections import defaultdict
+import datetime
+
+from django.db import connection, models
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+from .client_log_entry import ClientLogEntry
+
+
+ROLLUP_PLAYED_TYPES = (ClientLogEntry.Type.PLAYED_ASSET, ClientLogEntry.Type.PLAYED_SINGLE_PLAY_ROTATOR)
+ROLLUP_SKIPPED_TYPES = (ClientLogEntry.Type.SKIPPED_ASSET,)
+
+
+class PlayRollup(models.Model):
+    # Log entries can outlive (and are written without checking) what they refer to, so no foreign key constraints
+    hour = models.DateTimeField()
+    asset = models.ForeignKey("tomato.Asset", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    rotator = models.ForeignKey(
+        "tomato.Rotator", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", null=True
+    )
+    user = models.ForeignKey(
+        "tomato.User", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+", null=True
+    )
+    plays = models.PositiveIntegerField(default=0)
+    skips = models.PositiveIntegerField(default=0)
+    last_played_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.plays} play(s) of asset {self.asset_id} at {self.hour}"
+
+    @classmethod
+    def get_record_plays_query(cls, entries):
+        """Build a single upsert adding newly written client log entries to the rollup table, or None if none apply"""
+        rollups = defaultdict(lambda: [0, 0, None])
+        for entry in entries:
+            played = entry.type in ROLLUP_PLAYED_TYPES
+            if entry.asset_id is None or not (played or entry.type in ROLLUP_SKIPPED_TYPES):
+                continue
+            created_at = entry.created_at
+            if isinstance(created_at, str):  # As sent by the client
+                created_at = parse_datetime(created_at)
+            hour = created_at.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+            rollup = rollups[(hour, entry.asset_id, entry.rotator_id, entry.created_by_id)]
+            if played:
+                rollup[0] += 1
+                rollup[2] = max(filter(None, (rollup[2], created_at)))
+            else:
+                rollup[1] += 1
+
+        if not rollups:
+            return None
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rollups))
+        params = [param for key, rollup in rollups.items() for param in (*key, *rollup)]
+        return (
+            f"INSERT INTO {cls._meta.db_table} (hour, asset_id, rotator_id, user_id, plays, skips, last_played_at)"
+            f" VALUES {values} ON CONFLICT ON CONSTRAINT play_rollups_unique DO UPDATE SET"
+            " plays = play_rollups.plays + EXCLUDED.plays, skips = play_rollups.skips + EXCLUDED.skips,"
+            " last_played_at = GREATEST(play_rollups.last_played_at, EXCLUDED.last_played_at)",
+            params,
+        )
+
+    @classmethod
+    def record_plays(cls, entries):
+        if query := cls.get_record_plays_query(entries):
+            with connection.cursor() as cursor:
+                cursor.execute(*query)
+
+    @classmethod
+    def annotate_queryset_with_plays(cls, qs, field):
+        # Annotate an asset or rotator queryset with total plays and last aired time
+        rollups = cls.objects.filter(**{f"{field}_id": OuterRef("id")}).order_by().values(f"{field}_id")
+        return qs.annotate(
+            num_plays=Coalesce(Subquery(rollups.annotate(total=Sum("plays")).values("total")), 0),
+            last_aired_at=Subquery(rollups.annotate(last=Max("last_played_at")).values("last")),
+        )
+
+    class Meta:
+        verbose_name = "play rollup"
+        db_table = "play_rollups"
+        ordering = ("-hour",)
+        constraints = (
+            models.UniqueConstraint(
+                fields=("hour", "asset", "rotator", "user"), name="play_rollups_unique", nulls_distinct=False
+            ),
+        )
@@ -7,6 +7,8 @@ from .stopset import Stopset
 
 
 class Rotator(TomatoModelBase):
+    API_ENTITY_TYPE = "rotators"
+    API_FULL_REFRESH_ON_DELETE = True  # Cascades to asset and stop set rotator lists
     COLOR_CHOICES = tuple((c["name"], c["name"].replace("-", " ").title()) for c in COLORS)
     color = models.CharField(
         "Color",
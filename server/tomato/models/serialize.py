@@ -42,13 +42,9 @@ async def get_constance_config_for_api():
     return all_config
 
 
-async def serialize_for_api(*, skip_config=False, include_archived=False):
-    rotators = [rotator async for rotator in Rotator.objects.order_by("id")]
-    rotator_ids = [r.id for r in rotators]
-    # Only select from rotators that existed at time query was made
-    prefetch_qs = Rotator.objects.only("id").filter(id__in=rotator_ids)
+def get_assets_queryset_for_api(rotators_prefetch_qs, include_archived=False):
     assets = (
-        Asset.objects.prefetch_related(Prefetch("rotators", prefetch_qs.order_by("id")))
+        Asset.objects.prefetch_related(Prefetch("rotators", rotators_prefetch_qs.order_by("id")))
         .prefetch_related(
             Prefetch("alternates", AssetAlternate.objects.filter(status=AssetAlternate.Status.READY).order_by("id"))
         )
@@ -57,11 +53,23 @@ async def serialize_for_api(*, skip_config=False, include_archived=False):
     )
     if not include_archived:
         assets = assets.filter(archived=False)
+    return assets
 
-    stopsets = Stopset.objects.prefetch_related(
-        Prefetch("rotators", prefetch_qs.order_by("stopsetrotator__id"))
+
+def get_stopsets_queryset_for_api(rotators_prefetch_qs):
+    return Stopset.objects.prefetch_related(
+        Prefetch("rotators", rotators_prefetch_qs.order_by("stopsetrotator__id"))
     ).order_by("id")
 
+
+async def serialize_for_api(*, skip_config=False, include_archived=False):
+    rotators = [rotator async for rotator in Rotator.objects.order_by("id")]
+    rotator_ids = [r.id for r in rotators]
+    # Only select from rotators that existed at time query was made
+    prefetch_qs = Rotator.objects.only("id").filter(id__in=rotator_ids)
+    assets = get_assets_queryset_for_api(prefetch_qs, include_archived=include_archived)
+    stopsets = get_stopsets_queryset_for_api(prefetch_qs)
+
     data = {
         "assets": [a.serialize(alternates_already_filtered_by_prefetch=True) async for a in assets],
         "rotators": [r.serialize() for r in rotators],
@@ -72,4 +80,29 @@ async def serialize_for_api(*, skip_config=False, include_archived=False):
     return data
 
 
+async def serialize_changes_for_api(changes):
+    """Re-serialize only the entities in changes (as sent by notify_api_db_change()). Maps each entity type to a
+    dict of id -> serialized entity, or id -> None for entities that no longer exist (or are no longer served)."""
+    asset_ids, rotator_ids, stopset_ids = (changes.get(key, ()) for key in ("assets", "rotators", "stopsets"))
+    data = {
+        "assets": dict.fromkeys(asset_ids),
+        "rotators": dict.fromkeys(rotator_ids),
+        "stopsets": dict.fromkeys(stopset_ids),
+    }
+    prefetch_qs = Rotator.objects.only("id")
+
+    if rotator_ids:
+        async for rotator in Rotator.objects.filter(id__in=rotator_ids):
+            data["rotators"][rotator.id] = rotator.serialize()
+    if asset_ids:
+        async for asset in get_assets_queryset_for_api(prefetch_qs).filter(id__in=asset_ids):
+            data["assets"][asset.id] = asset.serialize(alternates_already_filtered_by_prefetch=True)
+    if stopset_ids:
+        async for stopset in get_stopsets_queryset_for_api(prefetch_qs).filter(id__in=stopset_ids):
+            data["stopsets"][stopset.id] = stopset.serialize()
+    if changes.get("config"):
+        data["config"] = await get_constance_config_for_api()
+    return data
+
+
 serialize_for_api_sync = async_to_sync(serialize_for_api)
@@ -4,6 +4,8 @@ from .base import DBNotifyBase, EnabledBeginEndWeightMixin, TomatoModelBase
 
 
 class Stopset(EnabledBeginEndWeightMixin, TomatoModelBase):
+    API_ENTITY_TYPE = "stopsets"
+
     class Meta(TomatoModelBase.Meta):
         db_table = "stopsets"
         verbose_name = "stop set"
@@ -19,6 +21,9 @@ class StopsetRotator(DBNotifyBase, models.Model):
     stopset = models.ForeignKey(Stopset, on_delete=models.CASCADE)
     rotator = models.ForeignKey("tomato.Rotator", on_delete=models.CASCADE, verbose_name="Rotator")
 
+    API_ENTITY_TYPE = "stopsets"
+    API_ENTITY_ID_FIELD = "stopset_id"
+
     def __str__(self):
         s = f"{self.rotator.name} in {self.stopset.name}"
         if self.id:
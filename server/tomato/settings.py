@@ -1,6 +1,7 @@
 from collections import OrderedDict
 import datetime
 from decimal import Decimal
+import os
 from pathlib import Path
 import re
 
@@ -25,6 +26,13 @@ TIME_ZONE = env("TIMEZONE", default="US/Pacific")
 
 DEBUG_LOGS_PORT = env.int("DEBUG_LOGS_PORT", default=8002)
 
+# Number of websocket API worker processes (connections are routed between them via redis)
+API_WORKERS = env.int("API_WORKERS", default=1)
+API_DB_POOL_SIZE = env.int("API_DB_POOL_SIZE", default=4)
+BULK_PROCESS_ASSETS_WORKERS = env.int("BULK_PROCESS_ASSETS_WORKERS", default=os.cpu_count() or 1)
+CONTENT_ADDRESSED_ASSETS = env.bool("CONTENT_ADDRESSED_ASSETS", default=False)
+NOTIFY_API_DEBOUNCE_WINDOW = env.float("NOTIFY_API_DEBOUNCE_WINDOW", default=0.1)
+
 EMAIL_ENABLED = env.bool("EMAIL_ENABLED", default=False)
 EMAIL_EXCEPTIONS_ENABLED = env.bool("EMAIL_EXCEPTIONS_ENABLED", default=False)
 PASSWORD_RESET_TIMEOUT = 60 * 60 * 6  # 6 hours
@@ -187,6 +195,7 @@ STATIC_URL = "/static/"
 STATIC_ROOT = "/serve/static"
 MEDIA_URL = "/assets/"
 MEDIA_ROOT = "/serve/assets"
+CLIENT_LOGS_ARCHIVE_ROOT = "/serve/client-logs-archive"  # Not served by nginx
 LOGIN_URL = "/login/"
 FILE_FORM_MUST_LOGIN = True
 FILE_FORM_UPLOAD_DIR = "_temp_uploads"
@@ -271,7 +280,7 @@ def validate_reset_times(values):
                 raise ValidationError(f'Error parsing time value: "{value}"')
 
 
-CONSTANCE_BACKEND = "constance.backends.database.DatabaseBackend"
+CONSTANCE_BACKEND = "tomato.constance_backend.CachedDatabaseBackend"
 CONSTANCE_SUPERUSER_ONLY = False
 CONSTANCE_IGNORE_ADMIN_VERSION_CHECK = True
 _style_full_width = {"style": "width: calc(100% - 5px)"}
@@ -335,6 +344,14 @@ CONSTANCE_ADDITIONAL_FIELDS = {
             "validators": (validate_reset_times,),
         },
     ),
+    "days": (
+        "django.forms.IntegerField",
+        {
+            "widget": "django.forms.TextInput",
+            "min_value": 0,
+            "max_value": 100 * 365,
+        },
+    ),
     "silence": (
         "django.forms.IntegerField",
         {
@@ -488,6 +505,15 @@ CONSTANCE_CONFIG = {
         "clock",
     ),
     "ENABLE_ASSET_DELETION": (True, "If disabled, no one can delete assets (can only archive soft delete)"),
+    "CLIENT_LOG_RETENTION_DAYS": (
+        0,
+        mark_safe(
+            "Client logs older than this many days are archived as compressed files on the server, one per month, and"
+            " removed from the database. Only whole months are archived. <strong>Set to 0 to disable</strong> and keep"
+            " all client logs."
+        ),
+        "days",
+    ),
 }
 
 CONSTANCE_CONFIG_FIELDSETS = OrderedDict((
@@ -513,6 +539,7 @@ CONSTANCE_CONFIG_FIELDSETS = OrderedDict((
             "RELOAD_PLAYLIST_AFTER_DATA_CHANGES",
         ),
     ),
+    ("Server maintenance", ("CLIENT_LOG_RETENTION_DAYS",)),
     (
         "Playout options",
         (
@@ -529,13 +556,15 @@ CONSTANCE_CONFIG_FIELDSETS = OrderedDict((
         ),
     ),
 ))
-CONSTANCE_SERVER_ONLY_SETTINGS = set(CONSTANCE_CONFIG_FIELDSETS["Server audio processing"])
+CONSTANCE_SERVER_ONLY_SETTINGS = set(CONSTANCE_CONFIG_FIELDSETS["Server audio processing"]) | set(
+    CONSTANCE_CONFIG_FIELDSETS["Server maintenance"]
+)
 
 SHELL_PLUS_IMPORTS = [
     "from constance import config",
     "from user_messages import api as user_messages_api",
     "from tomato import constants",
-    "from tomato.ffmpeg import ffmpeg_convert, ffprobe, silence_detect",
+    "from tomato.ffmpeg import analyze_audio, ffmpeg_convert, ffprobe",
     "from tomato.models import export_data_as_zip, import_data_from_zip, serialize_for_api",
     "from tomato.tasks import bulk_process_assets, process_asset, cleanup",
     "from tomato.utils import notify_api, notify_api_multiple",
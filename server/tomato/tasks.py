@@ -1,12 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
 import logging
 import os
 from pathlib import Path
 import tempfile
+import time
 
 from huey import crontab
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files import File
+from django.db import connection, transaction
+from django.utils import timezone
 from django.utils.html import strip_tags
 
 from constance import config
@@ -15,20 +21,25 @@ from huey.contrib import djhuey
 from user_messages import api as user_messages_api
 from user_messages.models import Message as UserMessage
 
-from .ffmpeg import ffmpeg_convert, ffprobe
-from .models import SavedAssetFile
+from .ffmpeg import analyze_audio, ffmpeg_convert
+from .models import ClientLogEntry, SavedAssetFile
 from .utils import (
     block_pending_notify_api_messages,
+    notify_api_multiple,
     once_at_startup,
     unblock_and_flush_blocked_pending_notify_api_messages,
+    unblock_and_get_blocked_pending_notify_api_messages,
 )
 
 
 logger = logging.getLogger(__name__)
+BULK_PROCESS_PROGRESS_INTERVAL = 30  # Seconds between progress messages to the user
+MEDIA_CLEANUP_MAX_FILES_PER_RUN = 50000  # Larger libraries get cleaned up over several runs
 
 
 @djhuey.db_task(context=True, retries=3, retry_delay=5)
 def process_asset(asset, *, empty_name=False, user=None, from_bulk=False, from_command_line_import=False, task=None):
+    # Returns False if the asset was deleted for not being valid audio, and raises on other failures
     def error(message):
         if user is not None:
             user_messages_api.error(
@@ -48,22 +59,22 @@ def process_asset(asset, *, empty_name=False, user=None, from_bulk=False, from_c
         logger.info(f"Processing {asset.name}")
         asset.status = asset.Status.PROCESSING
         asset.save()
-        asset.pre_process_md5sum = asset.generate_md5sum()
-        asset.save()
-
-        ffprobe_data = ffprobe(asset.file.real_path)
-        if not ffprobe_data:
+        # Usually cached from when the upload was validated. Processing only needs the probe, not a full decode.
+        analysis = analyze_audio(asset.file.real_path, decode=False)
+        if not analysis:
             error("does not appear to contain any audio")
-            return
+            return False
 
-        asset.duration = ffprobe_data.duration
+        asset.pre_process_md5sum = analysis.md5sum
+        asset.duration = analysis.duration
+        asset.save()
 
         if config.EXTRACT_METADATA_FROM_FILE and empty_name:
-            if ffprobe_data.title:
-                asset.name = ffprobe_data.title
+            if analysis.title:
+                asset.name = analysis.title
 
         infile = asset.file.real_path
-        if ffprobe_data.format != "mp3" or (config.TRIM_SILENCE and not from_command_line_import):
+        if analysis.format != "mp3" or (config.TRIM_SILENCE and not from_command_line_import):
             with tempfile.TemporaryDirectory() as temp_dir:
                 outfile = Path(temp_dir) / "out.mp3"
                 if not ffmpeg_convert(infile, outfile):
@@ -73,11 +84,16 @@ def process_asset(asset, *, empty_name=False, user=None, from_bulk=False, from_c
                 with open(outfile, "rb") as f:
                     asset.file.save(Path(asset.file.name).with_suffix(".mp3"), File(f), save=False)
 
-            ffprobe_data = ffprobe(asset.file.real_path)
+            # Also primes the cache for validating the converted file in full_clean() below
+            analysis = analyze_audio(asset.file.real_path, decode=False)
+            if not analysis:
+                raise Exception("ffmpeg converted file contains no audio!")
 
-        asset.duration = ffprobe_data.duration
-        asset.md5sum = asset.generate_md5sum()
+        asset.duration = analysis.duration
+        asset.md5sum = analysis.md5sum
         asset.filesize = os.path.getsize(asset.file.real_path)
+        if settings.CONTENT_ADDRESSED_ASSETS:
+            asset.store_content_addressed()
 
         asset.status = asset.Status.READY
         asset.save(dont_overwrite_original_filename=True)
@@ -94,7 +110,7 @@ def process_asset(asset, *, empty_name=False, user=None, from_bulk=False, from_c
                         error_msg = strip_tags(". ".join(error_list))
                         break
                 error(error_msg)
-                return
+                return False
 
         try:
             SavedAssetFile.objects.update_or_create(
@@ -105,6 +121,7 @@ def process_asset(asset, *, empty_name=False, user=None, from_bulk=False, from_c
 
         if not from_bulk and user is not None:
             user_messages_api.success(user, f'Audio asset "{asset.name}" successfully processed!')
+        return True
 
     except Exception:
         logger.exception("process_asset threw exception")
@@ -116,22 +133,55 @@ def process_asset(asset, *, empty_name=False, user=None, from_bulk=False, from_c
             unblock_and_flush_blocked_pending_notify_api_messages()
 
 
+def bulk_process_asset_in_thread(asset, **kwargs):
+    # Runs in a pool thread. Notifications are collected and handed back to bulk_process_assets() to flush once.
+    block_pending_notify_api_messages()
+    try:
+        succeeded = process_asset.call_local(asset, empty_name=True, from_bulk=True, **kwargs)
+    except Exception:
+        succeeded = False
+    finally:
+        connection.close()  # Each pool thread gets its own DB connection
+    return succeeded, unblock_and_get_blocked_pending_notify_api_messages()
+
+
 @djhuey.db_task()
 def bulk_process_assets(assets, *, user=None, from_command_line_import=False):
     try:
         block_pending_notify_api_messages()
 
-        for n, asset in enumerate(assets):
-            logger.info(f"Bulk processing {n}/{len(assets)} assets...")
-            try:
-                process_asset.call_local(
-                    asset, empty_name=True, user=user, from_bulk=True, from_command_line_import=from_command_line_import
+        # Threads are enough here, since the heavy lifting happens in ffmpeg subprocesses
+        num_workers = max(1, min(settings.BULK_PROCESS_ASSETS_WORKERS, len(assets)))
+        logger.info(f"Bulk processing {len(assets)} assets using {num_workers} workers...")
+        num_processed = num_failed = 0
+        last_progress = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="bulk_process_assets") as executor:
+            futures = [
+                executor.submit(
+                    bulk_process_asset_in_thread, asset, user=user, from_command_line_import=from_command_line_import
                 )
-            except Exception:
-                pass
+                for asset in assets
+            ]
+            for future in as_completed(futures):
+                succeeded, messages = future.result()
+                notify_api_multiple(messages)
+                num_processed += 1
+                if not succeeded:
+                    num_failed += 1
+                logger.info(f"Bulk processed {num_processed}/{len(assets)} assets...")
+
+                if (
+                    user is not None
+                    and num_processed < len(assets)
+                    and time.monotonic() - last_progress >= BULK_PROCESS_PROGRESS_INTERVAL
+                ):
+                    last_progress = time.monotonic()
+                    user_messages_api.info(user, f"Processed {num_processed} of {len(assets)} audio assets so far...")
 
         if user is not None:
-            user_messages_api.success(user, f"Finished processing {len(assets)} audio assets.")
+            failed_msg = f" ({num_failed} failed)" if num_failed else ""
+            user_messages_api.success(user, f"Finished processing {len(assets)} audio assets{failed_msg}.")
     finally:
         unblock_and_flush_blocked_pending_notify_api_messages()
 
@@ -148,4 +198,42 @@ def cleanup():
     deleted_messages, _ = UserMessage.objects.filter(delivered_at__isnull=False).delete()
     logger.info(f"Deleted {deleted_messages} already delivered user messages")
 
-    SavedAssetFile.cleanup_unreferenced_files()
+    SavedAssetFile.cleanup_unreferenced_files(max_files=MEDIA_CLEANUP_MAX_FILES_PER_RUN)
+
+
+@djhuey.db_periodic_task(crontab(hour="4", minute="15"))
+def archive_old_client_logs():
+    if config.CLIENT_LOG_RETENTION_DAYS == 0:
+        return
+
+    cutoff = timezone.localtime() - datetime.timedelta(days=config.CLIENT_LOG_RETENTION_DAYS)
+    archive_root = Path(settings.CLIENT_LOGS_ARCHIVE_ROOT)
+    archive_root.mkdir(parents=True, exist_ok=True)
+
+    # Archive one whole month at a time, oldest first
+    while oldest := ClientLogEntry.objects.order_by("created_at").values_list("created_at", flat=True).first():
+        month_start = timezone.localtime(oldest).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        month_end = (month_start + datetime.timedelta(days=32)).replace(day=1)
+        if month_end > cutoff:
+            break
+
+        # Unique name, since late arriving logs (ie from offline clients) may need a month archived more than once
+        archive_path = archive_root / (
+            f"client-logs-{month_start.strftime('%Y-%m')}-archived-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}"
+            ".ndjson.gz"
+        )
+        partial_path = archive_path.with_name(f".{archive_path.name}.partial")
+
+        with transaction.atomic():
+            # Rows inserted while archiving aren't in this snapshot, so the DELETE can't remove unarchived rows
+            connection.cursor().execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            month_logs = ClientLogEntry.objects.created_between(month_start, month_end)
+            with open(partial_path, "wb") as file:
+                for chunk in month_logs.export_ndjson_gz():
+                    file.write(chunk)
+            num_deleted, _ = month_logs.delete()  # One set-based DELETE for the whole month
+        partial_path.rename(archive_path)
+
+        logger.info(f"Archived {num_deleted} client logs from {month_start.strftime('%B %Y')} to {archive_path}")
+        if num_deleted == 0:
+            break
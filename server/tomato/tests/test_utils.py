@@ -0,0 +1,68 @@
+import io
+from pathlib import Path
+import tempfile
+import zipfile
+
+from django.test import SimpleTestCase
+
+from ..utils import coalesce_db_changes, stream_zip
+
+
+class CoalesceDBChangesTests(SimpleTestCase):
+    def test_merges_changes(self):
+        messages = [
+            ("db-change", {"changes": {"assets": [3, 1]}}),
+            ("db-change", {"changes": {"assets": [1, 2], "rotators": [5]}}),
+            ("db-change", {"changes": {"config": True}}),
+        ]
+        self.assertEqual(
+            coalesce_db_changes(messages),
+            [("db-change", {"changes": {"assets": [1, 2, 3], "rotators": [5], "config": True}})],
+        )
+
+    def test_full_refresh_wins(self):
+        messages = [
+            ("db-change", {"changes": {"assets": [1]}}),
+            "db-change",
+            ("db-change", {"changes": {"stopsets": [2]}}),
+        ]
+        self.assertEqual(coalesce_db_changes(messages), ["db-change"])
+
+    def test_keeps_force(self):
+        messages = [("db-change", {"changes": {"assets": [1]}}), ("db-change", {"force": True})]
+        self.assertEqual(coalesce_db_changes(messages), [("db-change", {"force": True})])
+
+    def test_other_messages_follow_in_order(self):
+        messages = [("route", {"a": 1}), ("db-change", {"changes": {"assets": [1]}}), "logout"]
+        self.assertEqual(
+            coalesce_db_changes(messages),
+            [("db-change", {"changes": {"assets": [1]}}), ("route", {"a": 1}), "logout"],
+        )
+
+    def test_no_db_changes(self):
+        self.assertEqual(coalesce_db_changes(["logout"]), ["logout"])
+        self.assertEqual(coalesce_db_changes([]), [])
+
+
+class StreamZipTests(SimpleTestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "audio.mp3"
+            contents = bytes(range(256)) * 100
+            path.write_bytes(contents)
+
+            chunks = list(
+                stream_zip([("assets/audio.mp3", path), ("metadata.json", b'{"version": 1}')], chunk_size=1000)
+            )
+
+        self.assertGreater(len(chunks), 2)  # Files are streamed in chunks, not built up in memory
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip:
+            self.assertIsNone(zip.testzip())
+            self.assertEqual(zip.namelist(), ["assets/audio.mp3", "metadata.json"])
+            self.assertEqual(zip.read("assets/audio.mp3"), contents)
+            self.assertEqual(zip.getinfo("assets/audio.mp3").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zip.read("metadata.json"), b'{"version": 1}')
+
+    def test_empty(self):
+        with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip([])))) as zip:
+            self.assertEqual(zip.namelist(), [])
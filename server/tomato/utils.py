@@ -1,13 +1,16 @@
+from functools import partial
 import json
 import logging
 import os
 from pathlib import Path
 import threading
+import zipfile
 
 from huey import PriorityRedisHuey
 
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import connection
+from django.db import connection, transaction
 
 from django_redis import get_redis_connection
 
@@ -15,6 +18,12 @@ from .constants import REDIS_MESSAGES_PUBSUB_KEY
 
 
 logger = logging.getLogger(__name__)
+# db-change messages from all processes are queued here and published together once per debounce window
+NOTIFY_API_DEBOUNCE_QUEUE_KEY = "tomato::notify-api-debounce-queue"
+NOTIFY_API_DEBOUNCE_LOCK_KEY = "tomato::notify-api-debounce-lock"
+# The lock outlives the window by this long. Once it's expired, the API drains the queue itself (ie, if the process
+# that was supposed to flush it died).
+NOTIFY_API_DEBOUNCE_LOCK_GRACE_MS = 1000
 
 
 def once_at_startup(crontab):
@@ -39,10 +48,24 @@ def django_json_dumps(obj):
     return concise_json_dumps(obj, cls=DjangoJSONEncoder)
 
 
-def listdir_recursive(dirname):
-    dirname = Path(dirname)
-    files = (os.path.join(dp, f) for dp, _, fn in os.walk(dirname) for f in fn)
-    return [str(Path(file).relative_to(dirname)) for file in files]
+def scandir_recursive(dirname, *, after=None, skip_dirs=()):
+    """Yield (relative path, os.DirEntry) for files below dirname in sorted order, optionally resuming after a path"""
+    after = Path(after).parts if after else ()
+
+    def scan(directory, parts):
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)  # Deterministic order, so we can resume
+        for entry in entries:
+            entry_parts = (*parts, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                # Skip directories that come entirely before the resume point
+                if entry_parts not in skip_dirs and entry_parts >= after[: len(entry_parts)]:
+                    yield from scan(entry.path, entry_parts)
+            elif entry.is_file(follow_symlinks=False) and entry_parts > after:
+                yield "/".join(entry_parts), entry
+
+    skip_dirs = {Path(skip_dir).parts for skip_dir in skip_dirs}
+    yield from scan(dirname, ())
 
 
 def pg_notify(channel, payload):
@@ -61,6 +84,48 @@ def dedupe(list_to_dedupe):
     return deduped
 
 
+class StreamingZipBuffer:
+    # Unseekable file-like object for ZipFile, which then writes data descriptors instead of seeking back to headers
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        chunks, self.chunks = self.chunks, []
+        return b"".join(chunks)
+
+
+def stream_zip(entries, chunk_size=1024 * 256):
+    """Generate a ZIP archive in chunks from (archive name, file path or bytes contents) entries"""
+    buffer = StreamingZipBuffer()
+    # Files are STORED (audio is already compressed), ZIP64 is used as needed for large files and archives
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zip:
+        for arcname, contents in entries:
+            if isinstance(contents, bytes):
+                zip.writestr(str(arcname), contents, compress_type=zipfile.ZIP_DEFLATED)
+            else:
+                zinfo = zipfile.ZipInfo.from_file(contents, str(arcname))
+                zinfo.compress_type = zipfile.ZIP_STORED
+                with open(contents, "rb") as src, zip.open(zinfo, "w") as dest:
+                    while chunk := src.read(chunk_size):
+                        dest.write(chunk)
+                        yield buffer.pop()
+            if data := buffer.pop():
+                yield data
+    yield buffer.pop()  # Central directory
+
+
 notify_api_local = threading.local()
 
 
@@ -68,15 +133,125 @@ def notify_api(message_type="db-change", extra_data=None, *, force=False):
     notify_api_multiple([message_type if extra_data is None else (message_type, extra_data)], force=force)
 
 
+def notify_api_db_change(changes: dict | None = None):
+    # changes maps entity type -> list of ids (or "config" -> True). None means the API should re-serialize everything.
+    notify_api("db-change", None if changes is None else {"changes": changes})
+
+
+def coalesce_db_changes(messages):
+    # Merge all db-change messages into one, so the API only re-serializes once per batch
+    other_messages = []
+    changes, has_db_change, full_refresh, force = {}, False, False, False
+    for message in messages:
+        message_type, data = (message, None) if isinstance(message, str) else message
+        if message_type != "db-change":
+            other_messages.append(message)
+            continue
+
+        has_db_change = True
+        data = data or {}
+        force = force or data.get("force", False)
+        if data.get("changes") is None:
+            full_refresh = True
+        elif not full_refresh:
+            for entity_type, ids in data["changes"].items():
+                if entity_type == "config":
+                    changes["config"] = True
+                else:
+                    changes.setdefault(entity_type, set()).update(ids)
+
+    if not has_db_change:
+        return other_messages
+
+    data = {}
+    if force:
+        data["force"] = True
+    if not full_refresh:
+        data["changes"] = {k: v if k == "config" else sorted(v) for k, v in changes.items()}
+    return [("db-change", data) if data else "db-change"] + other_messages
+
+
+def flush_debounced_notify_api_messages():
+    try:
+        redis = get_redis_connection()
+        with redis.pipeline() as pipe:
+            # Releasing the lock atomically with taking the queue means a message is either in it, or schedules a flush
+            pipe.lrange(NOTIFY_API_DEBOUNCE_QUEUE_KEY, 0, -1)
+            pipe.delete(NOTIFY_API_DEBOUNCE_QUEUE_KEY, NOTIFY_API_DEBOUNCE_LOCK_KEY)
+            queued, _ = pipe.execute()
+        if queued:
+            messages = coalesce_db_changes([json.loads(message) for message in queued])
+            logger.debug(f"Sending {len(queued)} debounced db-change notifications to API as one")
+            redis.publish(REDIS_MESSAGES_PUBSUB_KEY, concise_json_dumps(messages))
+    except Exception:
+        # Anything left queued is drained by the API once the lock expires
+        logger.exception("Error flushing debounced notifications to API")
+
+
+def publish_notify_api_messages(messages: list):
+    messages = dedupe(coalesce_db_changes(messages))
+    logger.debug(
+        f"Sending {len(messages)} notifications to API (de-duped) via redis with key {REDIS_MESSAGES_PUBSUB_KEY}"
+    )
+    redis = get_redis_connection()
+    window = settings.NOTIFY_API_DEBOUNCE_WINDOW
+    if window > 0:
+        db_changes = [message for message in messages if message == "db-change" or message[0] == "db-change"]
+        messages = [message for message in messages if message not in db_changes]  # Others go out immediately
+        if db_changes:
+            lock_timeout_ms = round(window * 1000) + NOTIFY_API_DEBOUNCE_LOCK_GRACE_MS
+            with redis.pipeline() as pipe:
+                pipe.rpush(NOTIFY_API_DEBOUNCE_QUEUE_KEY, *(concise_json_dumps(message) for message in db_changes))
+                pipe.set(NOTIFY_API_DEBOUNCE_LOCK_KEY, 1, nx=True, px=lock_timeout_ms)
+                _, got_lock = pipe.execute()
+            if got_lock:  # First one in the window flushes it
+                threading.Timer(window, flush_debounced_notify_api_messages).start()
+    if messages:
+        redis.publish(REDIS_MESSAGES_PUBSUB_KEY, concise_json_dumps(messages))
+
+
+class NotifyAPITransactionOutbox:
+    """Collects messages sent during transactions, publishing them together only once they commit"""
+
+    def __init__(self):
+        self.messages = []
+        self.pending_publishes = {}  # token -> savepoints its publish hook was registered in
+
+    def add(self, messages):
+        # Both hooks belong to the current savepoint, so Django drops them if it (or the transaction) is rolled back
+        savepoints = {sid for sid in connection.savepoint_ids if sid is not None}
+        transaction.on_commit(partial(self.collect, messages))
+        # This publish hook runs after any earlier one registered in the same or an inner savepoint, and whenever they
+        # would, so those leave publishing to it. Outside of savepoints, that's one publish per transaction.
+        self.pending_publishes = {
+            token: sids for token, sids in self.pending_publishes.items() if not savepoints <= sids
+        }
+        token = object()
+        self.pending_publishes[token] = savepoints
+        transaction.on_commit(partial(self.publish, token))
+
+    def collect(self, messages):
+        self.messages.extend(messages)
+
+    def publish(self, token):
+        if token in self.pending_publishes:
+            del self.pending_publishes[token]
+            messages, self.messages = self.messages, []
+            if messages:
+                publish_notify_api_messages(messages)
+
+
 def notify_api_multiple(messages: list, *, force=False):
     has_request = getattr(notify_api_local, "request", None) is not None
     is_blocking = getattr(notify_api_local, "blocked_pending_notify_api_messages_list", None) is not None
     if force or (not has_request and not is_blocking):
-        logger.debug(
-            f"Sending {len(messages)} notifications to API (de-duped) via redis with key {REDIS_MESSAGES_PUBSUB_KEY}"
-        )
-        redis = get_redis_connection()
-        redis.publish(REDIS_MESSAGES_PUBSUB_KEY, concise_json_dumps(dedupe(messages)))
+        if connection.in_atomic_block:
+            outbox = getattr(notify_api_local, "transaction_outbox", None)
+            if outbox is None:
+                outbox = notify_api_local.transaction_outbox = NotifyAPITransactionOutbox()
+            outbox.add(messages)
+        else:
+            publish_notify_api_messages(messages)
     elif has_request:
         notify_api_local.request._notify_api_messages.extend(messages)
     else:
@@ -93,6 +268,13 @@ def unblock_and_flush_blocked_pending_notify_api_messages():
     notify_api_local.blocked_pending_notify_api_messages_list = None
 
 
+def unblock_and_get_blocked_pending_notify_api_messages():
+    # For worker threads to hand their messages off to the thread that will flush them
+    messages = getattr(notify_api_local, "blocked_pending_notify_api_messages_list", None) or []
+    notify_api_local.blocked_pending_notify_api_messages_list = None
+    return messages
+
+
 class DjangoPriorityRedisHuey(PriorityRedisHuey):
     def __init__(self, *args, **kwargs):
         connection = get_redis_connection()